@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import math
+import os
+import os.path
+import random
+import resource
+import struct
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+"""
+Offline benchmark of the geotagging:
+    - generates a synthetic YYYY/YYYY_MM_DD tree of JPEG files tagged with
+      GPS positions: tight clusters (bursts of pictures at the same place),
+      road trips (pictures along a line) and pictures without GPS
+    - starts a local HTTP server answering like the OpenMaps
+      reverse?format=jsonv2 API, with a configurable latency
+    - runs geotag_dir on each folder or the main.py pipeline on the tree
+      and reports pictures/s, lookups/s, cache hit ratio (including the
+      NearbyIndex answers) and peak RSS
+Usage:
+    python3 benchmark.py --folders 50 --pictures 200 --latency 0.05
+"""
+
+# Size in degrees of a place answered by the OpenMaps stub (~1km)
+STUB_PLACE_SIZE = 0.01
+# Place of the 'home' distribution
+HOME = (44.4268, 26.1025)
+
+
+def tiff_gps(latitude, longitude, date_time, order='<'):
+    """ Returns a TIFF structure with the GPS IFD and the Exif IFD
+        (DateTimeOriginal), little ('<') or big ('>') endian.
+        Also used by test_exif.py
+    """
+    def entry(tag, tag_type, count, value):
+        return struct.pack(order + 'HHI', tag, tag_type, count) + value
+
+    def rational(degrees):
+        degrees = abs(degrees)
+        minutes = (degrees - int(degrees)) * 60
+        seconds = (minutes - int(minutes)) * 60
+        return struct.pack(order + '6I', int(degrees), 1, int(minutes), 1,
+                           int(seconds * 10000), 10000)
+
+    date_time = date_time.encode('ascii') + b'\0'
+    # Header, IFD0 (2 entries), Exif IFD (1 entry), date, GPS IFD (4 entries)
+    exif_offset = 8 + 30
+    date_offset = exif_offset + 18
+    gps_offset = date_offset + len(date_time)
+    values_offset = gps_offset + 54
+    tiff = (b'II' if order == '<' else b'MM') + struct.pack(
+        order + 'HI', 42, 8)
+    tiff += struct.pack(order + 'H', 2) + entry(
+        0x8769, 4, 1, struct.pack(order + 'I', exif_offset)) + entry(
+        0x8825, 4, 1, struct.pack(order + 'I', gps_offset)) + bytes(4)
+    tiff += struct.pack(order + 'H', 1) + entry(
+        0x9003, 2, len(date_time),
+        struct.pack(order + 'I', date_offset)) + bytes(4)
+    tiff += date_time
+    tiff += struct.pack(order + 'H', 4) + entry(
+        1, 2, 2, (b'S' if latitude < 0 else b'N') + bytes(3)) + entry(
+        2, 5, 3, struct.pack(order + 'I', values_offset)) + entry(
+        3, 2, 2, (b'W' if longitude < 0 else b'E') + bytes(3)) + entry(
+        4, 5, 3, struct.pack(order + 'I', values_offset + 24)) + bytes(4)
+    return tiff + rational(latitude) + rational(longitude)
+
+
+def jpeg(latitude=None, longitude=None, date_time='2018:09:10 10:00:00',
+         size=4096):
+    """ Returns the bytes of a JPEG file with an Exif segment (GPS tags only
+        if latitude and longitude are given), padded to size bytes
+    """
+    data = b'\xff\xd8'
+    if latitude is not None and longitude is not None:
+        app1 = b'Exif\0\0' + tiff_gps(latitude, longitude, date_time)
+        data += b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+    data += b'\xff\xda'
+    return data + bytes(max(0, size - len(data) - 2)) + b'\xff\xd9'
+
+
+def _positions(distribution, count, rng):
+    """ Returns count GPS positions (or None for pictures without GPS)
+    """
+    start = (rng.uniform(-60, 60), rng.uniform(-180, 180))
+    if distribution == 'home':
+        # The same place in all the folders, ~10m of jitter
+        return [(HOME[0] + rng.gauss(0, 0.0001),
+                 HOME[1] + rng.gauss(0, 0.0001)) for _ in range(count)]
+    if distribution == 'cluster':
+        # A few places, ~10m of jitter around each one
+        places = [(start[0] + rng.uniform(-0.1, 0.1),
+                   start[1] + rng.uniform(-0.1, 0.1))
+                  for _ in range(max(1, count // 100))]
+        return [(lat + rng.gauss(0, 0.0001), lon + rng.gauss(0, 0.0001))
+                for lat, lon in (rng.choice(places) for _ in range(count))]
+    if distribution == 'roadtrip':
+        # Along a 200km line
+        bearing = rng.uniform(0, 2 * math.pi)
+        return [(start[0] + 2 * i / count * math.sin(bearing),
+                 start[1] + 2 * i / count * math.cos(bearing))
+                for i in range(count)]
+    return [None] * count
+
+
+def generate_tree(root, folders=10, pictures=100, start_year=2018,
+                  distributions=('cluster', 'roadtrip'), no_gps=0.1,
+                  size=4096, seed=0):
+    """ Generates a tree of folders root/YYYY/YYYY_MM_DD with JPEG files
+
+        Args:
+            root: directory where the tree is generated
+            folders: number of folders
+            pictures: number of pictures per folder
+            start_year: year of the first folder
+            distributions: GPS distributions, used in turn for the folders:
+                'cluster', 'roadtrip', 'home' (the same place in all the
+                folders) or 'nogps'
+            no_gps: ratio of pictures without GPS in each folder
+            size: size of each file in bytes
+            seed: seed of the random generator
+        Returns:
+            list of the generated folders
+    """
+    rng = random.Random(seed)
+    day = date(start_year, 1, 1)
+    generated = []
+    for i in range(folders):
+        day += timedelta(days=rng.randint(1, 5))
+        folder = os.path.join(
+            root, str(day.year), day.strftime('%Y_%m_%d'))
+        os.makedirs(folder, exist_ok=True)
+        positions = _positions(
+            distributions[i % len(distributions)], pictures, rng)
+        date_time = day.strftime('%Y:%m:%d 10:00:00')
+        for j, position in enumerate(positions):
+            if position is None or rng.random() < no_gps:
+                position = (None, None)
+            with open(os.path.join(
+              folder, 'IMG_{:04d}.jpg'.format(j)), 'wb') as f:
+                f.write(jpeg(*position, date_time=date_time, size=size))
+        generated.append(folder)
+    return generated
+
+
+class OpenMapsStub(object):
+    """Description:
+            Local HTTP server answering like OpenMaps reverse?format=jsonv2.
+            The answered place depends on the STUB_PLACE_SIZE cell of the
+            position (or the city, up to zoom 10). Each answer is delayed
+            by 'latency' seconds.
+
+       Usage:
+            with OpenMapsStub(latency=0.05) as stub:
+                stub.url, stub.requests
+    """
+    def __init__(self, latency=0.0, port=0):
+        stub = self
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = parse_qs(urlparse(self.path).query)
+                with stub._lock:
+                    stub.requests += 1
+                time.sleep(stub.latency)
+                try:
+                    body = stub.answer(
+                        float(params['lat'][0]), float(params['lon'][0]),
+                        int(params.get('zoom', [18])[0]))
+                    self.send_response(200)
+                except (KeyError, ValueError):
+                    body = {'error': 'Unable to geocode'}
+                    self.send_response(400)
+                body = json.dumps(body).encode('utf-8')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}/reverse?format=jsonv2'.format(
+            self._server.server_address[1])
+
+    @staticmethod
+    def answer(latitude, longitude, zoom=18):
+        i = math.floor(latitude / STUB_PLACE_SIZE)
+        j = math.floor(longitude / STUB_PLACE_SIZE)
+        return {
+            # Up to zoom 10, the city is the most detailed level
+            'name': 'Place {}_{}'.format(i, j) if zoom > 10 else
+            'City {}_{}'.format(i // 10, j // 10),
+            'address': {
+                'city': 'City {}_{}'.format(i // 10, j // 10),
+                'state': 'State {}_{}'.format(i // 100, j // 100),
+                'country': 'Country {}'.format(i // 1000)
+                }
+            }
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def run(root, mode='geotag_dir', latency=0.0):
+    """ Geotags the tree (without DB) against the OpenMaps stub
+
+        Args:
+            root: root of the generated tree
+            mode: 'geotag_dir' to call geotag_dir for each folder,
+                'main' to run the main.py pipeline or 'prefetch' to run
+                it after the prefetch of all the places
+            latency: latency of the OpenMaps stub in seconds
+        Returns:
+            dictionary with the results
+    """
+    # Imported here, so that the generator and the stub can be
+    # used without a config.yaml
+    import discovery
+    import metrics
+    import photos
+    import main
+    import prefetch
+
+    folders_list = list(discovery.walk(root))
+    pictures = sum(len(os.listdir(folder)) for folder in folders_list)
+    with OpenMapsStub(latency) as stub:
+        photos.config['openmaps_base_url'] = stub.url
+        start = time.monotonic()
+        if mode == 'prefetch':
+            prefetch.run(folders_list, skip_db=True)
+        if mode in ('main', 'prefetch'):
+            main.run_pipeline(folders_list, skip_db=True)
+        else:
+            for folder in folders_list:
+                photos.geotag_dir(folder, skip_db=True)
+        elapsed = time.monotonic() - start
+    cache_info = photos.openmaps_response.cache.cache_info()
+    # Points answered by the NearbyIndex, before the cache is checked
+    nearby_hits = sum(
+        value for name, value in metrics.registry.summary()[
+            'counters'].items() if name.startswith('nearby_hits_total'))
+    hits = cache_info['hits'] + nearby_hits
+    calls = hits + cache_info['misses']
+    return {
+        'mode': mode,
+        'folders': len(folders_list),
+        'pictures': pictures,
+        'seconds': round(elapsed, 3),
+        'pictures_per_second': round(pictures / elapsed, 1),
+        'lookups': stub.requests,
+        'lookups_per_second': round(stub.requests / elapsed, 1),
+        'nearby_hits': nearby_hits,
+        'cache_hit_ratio': round(hits / calls, 3) if calls else None,
+        # KB on Linux
+        'peak_rss_mb': round(resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", help="tree to generate or reuse",
+                        default="benchmark_photos")
+    parser.add_argument("--folders", type=int, default=10)
+    parser.add_argument("--pictures", type=int, default=100,
+                        help="pictures per folder")
+    parser.add_argument("--distributions", default="cluster,roadtrip",
+                        help="comma separated: cluster, roadtrip, home, "
+                        "nogps")
+    parser.add_argument("--no-gps", type=float, default=0.1,
+                        help="ratio of pictures without GPS")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="OpenMaps stub latency in seconds")
+    parser.add_argument("--mode", default='geotag_dir',
+                        choices=['geotag_dir', 'main', 'prefetch'])
+    parser.add_argument("--skip-generate", action="store_true",
+                        help="reuse the tree in --root")
+    args = parser.parse_args()
+
+    if not args.skip_generate:
+        generate_tree(args.root, args.folders, args.pictures,
+                      distributions=args.distributions.split(','),
+                      no_gps=args.no_gps)
+    print(json.dumps(run(args.root, args.mode, args.latency), indent=1))
@@ -1,7 +1,11 @@
 import yaml
-from collections import deque
-import os.path
+import json
+import sqlite3
+import sys
 import time
+from collections import OrderedDict
+import os.path
+import threading
 import logger
 
 log = logger.generate_logger()
@@ -10,64 +14,359 @@ log = logger.generate_logger()
 Simple cache implementation: takes as an argument function
 and returns a wrapped function - wrapper
 The cache will store the return values of the function(based on the arguments)
-in a dict serialized as yaml with a max. capacity. The dict will have the
-function arguments as key, and the result as value. An addional key for the
-dictionary - 'indexes' will be used to hold information about the order of
-items in the dictionary. The value of this key will be a dequeue.
-The first class will be used just to load or persist cache from/to the disk.
+in an OrderedDict kept in LRU order: a hit moves the key to the end and the
+least recently used keys are evicted from the beginning once the max. number
+of entries or the max. size in bytes is reached. Entries can also expire
+after a TTL.
+The first class is the persistent store behind the in-memory cache: a SQLite
+database with the results serialized as JSON, keyed by the normalized
+function arguments. Each result is written when it arrives and looked up
+on its own, so the database is never loaded as a whole. Entries may have
+an expiration time (ex. negative answers, cached for a while only).
+Several stores can be chained with TieredStore (memory -> disk -> the
+geocode_cache collection shared by all the hosts).
 """
 
 
+def normalize_key(args):
+    """ Returns the key of the persistent cache for the function arguments.
+        Coordinates are rounded to 6 decimals (~10cm), so the same point
+        read as int, float or str gives the same key
+    """
+    key = []
+    for arg in args:
+        try:
+            key.append('{:.6f}'.format(float(arg)))
+        except (TypeError, ValueError):
+            key.append(str(arg))
+    return ','.join(key)
+
+
 class DiskCache(object):
+    """Description:
+            SQLite backed cache. If cache_file is a YAML cache (the previous
+            format), it is migrated once to a database with the same name
+            and the '.db' extension.
+
+            The database is opened by load() or on the first lookup.
+
+       Usage:
+            disk_cache = DiskCache('cache.db').load()
+            disk_cache.set((44.4268, 26.1025), payload)
+            disk_cache.set((0.0, 0.0), {'error': 'Unable to geocode'},
+                           ttl=86400)
+            disk_cache.get((44.4268, 26.1025))
+            disk_cache.close()
+    """
     def __init__(self, cache_file, enabled=True):
         self._cache_file = cache_file
         self._enabled = enabled
+        self._db = None
+        # Reentrant: load() may be called on the first lookup and
+        # the migration writes through set()
+        self._lock = threading.RLock()
 
     def load(self):
-        try:
-            with open(self._cache_file, 'r') as f:
-                self._cache = yaml.load(f)
-        except FileNotFoundError:
-            self._cache = {}
-            self._cache['indexes'] = deque()
-        finally:
-            return self._cache
+        root, ext = os.path.splitext(self._cache_file)
+        yaml_file = None
+        if ext in ('.yml', '.yaml'):
+            yaml_file, self._cache_file = self._cache_file, root + '.db'
+        migrate = yaml_file is not None and os.path.exists(
+            yaml_file) and not os.path.exists(self._cache_file)
+        # The wrapped functions can be called from multiple threads
+        self._db = sqlite3.connect(self._cache_file, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+            columns = [row[1] for row in self._db.execute(
+                'PRAGMA table_info(cache)')]
+            if 'expires' not in columns:
+                # Created before the expiration of the entries
+                self._db.execute('ALTER TABLE cache ADD COLUMN expires REAL')
+        if migrate:
+            self.migrate(yaml_file)
+        return self
+
+    def migrate(self, yaml_file):
+        """ Imports the entries of a YAML cache. OpenMaps API responses
+            are stored as their parsed JSON payload
+        """
+        with open(yaml_file, 'r') as f:
+            # The YAML cache holds pickled requests.Response objects
+            yaml_cache = yaml.load(f, Loader=yaml.Loader) or {}
+        yaml_cache.pop('indexes', None)
+        migrated = 0
+        for args, value in yaml_cache.items():
+            if hasattr(value, 'json'):
+                try:
+                    value = value.json()
+                except ValueError:
+                    continue
+            if value is None:
+                continue
+            self.set(args, value)
+            migrated += 1
+        log.warning("Migrated {} entries from {} to {}".format(
+            migrated, yaml_file, self._cache_file))
+
+    def __len__(self):
+        self._connect()
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def __contains__(self, args):
+        return self.get(args) is not None
+
+    def _connect(self):
+        with self._lock:
+            if self._db is None:
+                self.load()
+
+    def get(self, args):
+        if not self._enabled:
+            return None
+        self._connect()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, expires FROM cache WHERE key = ?',
+                (normalize_key(args),)).fetchone()
+        if row is None or row[1] is not None and row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, args, value, ttl=None):
+        """ Stores the value, expiring after ttl seconds if given
+        """
+        if not self._enabled:
+            return
+        self._connect()
+        expires = time.time() + ttl if ttl else None
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                (normalize_key(args), json.dumps(value), expires))
+
+    def items(self):
+        """ Yields the (arguments, value) of the entries not expired. The
+            arguments are parsed back from the keys as floats (or str)
+        """
+        if not self._enabled:
+            return
+        self._connect()
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT key, value FROM cache WHERE expires IS NULL '
+                'OR expires >= ?', (time.time(),)).fetchall()
+        for key, value in rows:
+            args = []
+            for arg in key.split(','):
+                try:
+                    args.append(float(arg))
+                except ValueError:
+                    args.append(arg)
+            yield tuple(args), json.loads(value)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
 
-    def persist(self):
-        with open(self._cache_file, 'w') as f:
-            yaml.dump(self._cache, f)
+class TieredStore(object):
+    """Description:
+            Persistent stores of a Cache, checked in order (ex. the local
+            DiskCache, then the collection shared by all the hosts). A value
+            found in a tier is written back to the tiers above it, new
+            values are written to all the tiers. ttl_for(value) gives the
+            TTL of the values written back.
+
+       Usage:
+            store = TieredStore([('disk', disk_cache),
+                                 ('shared', mongo.MongoCache())])
+            @Cache(store=store)
+            def func(*args):
+                ...
+            store.cache_info()
+    """
+    def __init__(self, tiers, ttl_for=None):
+        self.tiers = tiers
+        self._ttl_for = ttl_for
+        self.hits = {name: 0 for name, store in tiers}
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def cache_info(self):
+        info = {'{}_hits'.format(name): hits
+                for name, hits in self.hits.items()}
+        info['misses'] = self.misses
+        return info
+
+    def get(self, args):
+        for index, (name, store) in enumerate(self.tiers):
+            value = store.get(args)
+            if value is None:
+                continue
+            with self._lock:
+                self.hits[name] += 1
+            ttl = self._ttl_for(value) if self._ttl_for else None
+            for upper_name, upper_store in self.tiers[:index]:
+                upper_store.set(args, value, ttl)
+            return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, args, value, ttl=None):
+        for name, store in self.tiers:
+            store.set(args, value, ttl)
+
+
+def _sizeof(value):
+    """ Approximate size in bytes of a cached value
+    """
+    try:
+        return len(json.dumps(value))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
 
 
 class Cache(object):
-    # Default load_from_cache to false.
-    # In case, cache is hit, will be set to true
-    load_from_cache = False
+    """Description:
+            LRU cache decorator. Each instance keeps its own counters
+            (hits, misses, evictions). load_from_cache is set to True
+            by the last call if it was a hit. With maxsize=0, results are
+            only kept by the store. None results (failed calls)
+            are not cached. ttl_for(result) may return a TTL specific to
+            a result (ex. shorter for negative answers), also used by
+            the store.
 
-    def __init__(self, cache={}, maxsize=1024):
-        self._cache = cache
+       Usage:
+            @Cache(maxsize=1024, maxbytes=None, ttl=None, store=disk_cache,
+                   ttl_for=None)
+            def func(*args):
+                ...
+            func.cache.cache_info()
+    """
+    def __init__(self, maxsize=1024, maxbytes=None, ttl=None, store=None,
+                 ttl_for=None):
+        # key -> (value, size, expiration time or None)
+        self._cache = OrderedDict()
         self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._ttl = ttl
+        self._ttl_for = ttl_for
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_from_cache = False
+        # Persistent store (DiskCache) checked on in-memory misses
+        # and written for each new result
+        self.store = store
+        # The wrapped function can be called from multiple threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, args):
+        """ True if the result is cached, in memory or in the store.
+            The counters are not updated
+        """
+        hit, value = self._get(args)
+        return hit or self.store is not None and \
+            self.store.get(args) is not None
 
-    def _update_cache(self, key, value):
-        self._cache['indexes'].append(key)
-        self._cache[key] = value
+    def cache_info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._cache),
+            'bytes': self._bytes
+            }
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                value, size, expires = self._cache[key]
+            except KeyError:
+                return False, None
+            if expires is not None and expires < time.monotonic():
+                del self._cache[key]
+                self._bytes -= size
+                return False, None
+            self._cache.move_to_end(key)
+            return True, value
+
+    def _update_cache(self, key, value, ttl=None):
+        # Results kept only by the store
+        if not self._maxsize:
+            return
+        size = _sizeof(value)
+        ttl = ttl or self._ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._cache:
+                self._bytes -= self._cache.pop(key)[1]
+            self._cache[key] = (value, size, expires)
+            self._bytes += size
+            # Evict cache if max limit is reached
+            self._evict_cache()
+
+    def set(self, args, value):
+        """ Caches a result as if it was returned by the function
+            (in memory and in the persistent store)
+        """
+        ttl = self._ttl_for(value) if self._ttl_for else None
+        if self.store is not None:
+            self.store.set(args, value, ttl)
+        self._update_cache(args, value, ttl)
+
+    def put(self, args, value, ttl=None):
+        """ Adds a result to the in-memory cache, without calling
+            the function (ex. entries replayed from a journal)
+        """
+        self._update_cache(args, value, ttl)
 
     def _evict_cache(self):
-        if len(self._cache) >= self._maxsize:
-            key = self._cache['indexes'].popleft()
-            del self._cache[key]
+        while self._cache and (
+          len(self._cache) > self._maxsize or
+          self._maxbytes and self._bytes > self._maxbytes):
+            key, (value, size, expires) = self._cache.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
 
     def __call__(self, function, *args):
         def wrapper(*args):
             # if args in cache dict -> return
-            if args in self._cache:
-                Cache.load_from_cache = True
-                log.info("Hit cache for key: {}".format(args))
-                return self._cache[args]
+            hit, result = self._get(args)
+            # if not, check the persistent store
+            if not hit and self.store is not None:
+                result = self.store.get(args)
+                if result is not None:
+                    hit = True
+                    self._update_cache(args, result, self._ttl_for(
+                        result) if self._ttl_for else None)
+            self.load_from_cache = hit
+            if hit:
+                self.hits += 1
+                log.debug("Hit cache for key: {}".format(args))
+                return result
             # if not continue. Call the function to get the result
             # Add the result in the cache
-            time.sleep(1)
-            self._update_cache(args, function(*args))
-            # Evict cache if max limit is reached
-            self._evict_cache()
-            return self._cache[args]
+            self.misses += 1
+            result = function(*args)
+            # Failed calls are not cached, they are retried next time
+            if result is None:
+                return result
+            ttl = self._ttl_for(result) if self._ttl_for else None
+            if self.store is not None:
+                self.store.set(args, result, ttl)
+            self._update_cache(args, result, ttl)
+            return result
+        wrapper.cache = self
         return wrapper
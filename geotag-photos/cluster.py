@@ -0,0 +1,117 @@
+import math
+from collections import Counter
+
+"""
+Groups the GPS points of a directory in clusters, so that only one point
+per cluster needs to be geocoded. The points are snapped to a grid with
+cells of 'radius' metres. The representative of a cluster is its most
+frequent exact point and the weight is the number of points in the cluster.
+centre() gives a single point for all the points of a cell.
+morton() gives the Z-order code of a point, to sort points so that close
+points are next to each other.
+"""
+
+METRES_PER_DEGREE = 111320.0
+
+
+def snap(latitude, longitude, radius=0):
+    """ Returns the key of the grid cell of the point
+
+        Args:
+            latitude, longitude: coordinates of the point
+            radius: size of the cell in metres. If 0, the key is
+                the exact point
+        Returns:
+            tuple identifying the cell
+    """
+    if not radius:
+        return (latitude, longitude)
+    lat_step = radius / METRES_PER_DEGREE
+    i = math.floor(latitude / lat_step)
+    # Longitude degrees get shorter towards the poles
+    lon_step = lat_step / max(math.cos(math.radians(i * lat_step)), 0.01)
+    return (i, math.floor(longitude / lon_step))
+
+
+def centre(latitude, longitude, radius):
+    """ Returns the centre of the grid cell of the point (see snap), the
+        same (latitude, longitude) for all the points of the cell
+    """
+    i, j = snap(latitude, longitude, radius)
+    lat_step = radius / METRES_PER_DEGREE
+    lon_step = lat_step / max(math.cos(math.radians(i * lat_step)), 0.01)
+    return (round((i + 0.5) * lat_step, 6), round((j + 0.5) * lon_step, 6))
+
+
+def cluster_points(points, radius=0):
+    """ Groups the points by their grid cell
+
+        Args:
+            points: iterable of (latitude, longitude)
+            radius: size of the cell in metres
+        Returns:
+            list of ((latitude, longitude), weight) - one per cluster,
+            in the order in which the clusters were first seen
+    """
+    clusters = {}
+    for point in points:
+        clusters.setdefault(snap(*point, radius), Counter())[point] += 1
+    return [(members.most_common(1)[0][0], sum(members.values()))
+            for members in clusters.values()]
+
+
+def heavy_groups(keys, weights, min_weight):
+    """ Returns the indexes of the items of the groups (items having the
+        same key) weighing at least min_weight altogether
+
+        Args:
+            keys: key of the group of each item, None for no group
+            weights: weight of each item
+            min_weight: minimum total weight of a group
+        Returns:
+            sorted list of indexes
+    """
+    totals = Counter()
+    for key, weight in zip(keys, weights):
+        if key is not None:
+            totals[key] += weight
+    return [index for index, key in enumerate(keys)
+            if key is not None and totals[key] >= min_weight]
+
+
+def _spread(byte):
+    """ Returns the bits of the byte spread to the even bits
+    """
+    spread = 0
+    for bit in range(8):
+        spread |= ((byte >> bit) & 1) << (2 * bit)
+    return spread
+
+
+_SPREAD = [_spread(byte) for byte in range(256)]
+
+
+def _interleave(value):
+    spread = 0
+    shift = 0
+    while value:
+        spread |= _SPREAD[value & 0xff] << shift
+        value >>= 8
+        shift += 16
+    return spread
+
+
+def morton(latitude, longitude, bits=24):
+    """ Returns the Z-order (Morton) code of the point: the bits of the
+        quantized longitude and latitude interleaved
+
+        Args:
+            latitude, longitude: coordinates of the point
+            bits: bits per coordinate (24: ~2m at the equator)
+        Returns:
+            int of 2 * bits bits
+    """
+    scale = (1 << bits) - 1
+    x = int((longitude + 180.0) / 360.0 * scale)
+    y = int((latitude + 90.0) / 180.0 * scale)
+    return _interleave(x) | _interleave(y) << 1
@@ -1,28 +1,76 @@
-from cache import DiskCache
-import logger
+import os
+import sys
+import threading
 import yaml
-import mongo
+import logger
+
+"""
+Shared configuration of the modules. config.yaml (or the file given by the
+GEOTAG_CONFIG environment variable) is read once, the first time a setting
+is needed. Nothing expensive happens at import: the DB is checked only when
+check_db() is called.
+"""
+
+
+class Config(object):
+    """Description:
+            Settings of config.yaml, loaded on first access.
+            Behaves like a (read/write) dictionary.
+
+       Usage:
+            config = Config('config.yaml')
+            config['photos_path'], config.get('start_year', 'all')
+    """
+    def __init__(self, filename='config.yaml'):
+        self._filename = filename
+        self._config = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._config is None:
+            with self._lock:
+                if self._config is None:
+                    try:
+                        with open(self._filename, 'r') as fh:
+                            self._config = yaml.safe_load(fh) or {}
+                    except FileNotFoundError:
+                        sys.exit(1)
+        return self._config
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
 
 
-def load_config():
-    try:
-        with open('config.yaml', 'r') as fh:
-            config = yaml.load(fh)
-            return config
-    except FileNotFoundError:
-        sys.exit(1)
+_db_available = None
 
 
 def check_db():
-    try:
-        with mongo.MongoConnector() as db:
-            if db.find_one():
-                return True
-    except (errors.ConnectionFailure, errors.ConfigurationError) as e:
-        return False
+    """ Checks (once, on first call) if the DB is reachable
+    """
+    global _db_available
+    if _db_available is None:
+        import mongo
+        from pymongo import errors
+        try:
+            with mongo.MongoConnector() as db:
+                db.database.client.admin.command('ping')
+            _db_available = True
+        except (errors.PyMongoError, KeyError) as e:
+            _db_available = False
+    return _db_available
 
 
-mongo = check_db()
-config = load_config()
+config = Config(os.environ.get('GEOTAG_CONFIG', 'config.yaml'))
 log = logger.generate_logger()
-cache = DiskCache(config['cache_file'])
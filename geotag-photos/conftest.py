@@ -0,0 +1,85 @@
+import collections
+import concurrent.futures
+import os
+import tempfile
+import pytest
+
+# The tests don't read the local config.yaml. Set before the first import
+# of config, by the test modules
+_directory = tempfile.mkdtemp(prefix='geotag-test-')
+with open(os.path.join(_directory, 'config.yaml'), 'w') as f:
+    f.write('''\
+openmaps_base_url: http://localhost/reverse?format=jsonv2
+openmaps_rate: 0
+cache_file: {0}/cache.db
+photos_path: {0}/photos
+cluster_radius: 25
+log_filename:
+log_level: WARNING
+'''.format(_directory))
+os.environ['GEOTAG_CONFIG'] = os.path.join(_directory, 'config.yaml')
+
+
+class StubResponse(object):
+    def __init__(self, payload):
+        self.ok = True
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class StubClient(object):
+    """Description:
+            OpenMaps client answering from a dictionary (latitude,
+            longitude) -> payload, or None for a failed request. The other
+            points are all in Bucharest (answer() can be replaced). The
+            requests are recorded as (latitude, longitude, zoom).
+    """
+    def __init__(self):
+        self.answers = {}
+        self.requests = []
+
+    def answer(self, latitude, longitude, zoom=None):
+        return self.answers.get((latitude, longitude), {
+            'name': 'Piata Unirii' if not zoom else None,
+            'address': {'city': 'Bucharest', 'country': 'Romania'}})
+
+    def get(self, latitude, longitude, zoom=None):
+        self.requests.append((latitude, longitude, zoom))
+        payload = self.answer(latitude, longitude, zoom)
+        return StubResponse(payload) if payload is not None else None
+
+    def url(self, latitude, longitude, zoom=None):
+        return 'http://localhost/reverse?lat={}&lon={}&zoom={}'.format(
+            latitude, longitude, zoom)
+
+    def map(self, function, points):
+        futures = []
+        for point in points:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(function(*point))
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+        return futures
+
+
+@pytest.fixture
+def openmaps(monkeypatch, tmp_path):
+    """ Replaces the OpenMaps client by a StubClient, with empty caches
+    """
+    import cache
+    import geocoder
+    import photos
+    client = StubClient()
+    store = cache.DiskCache(str(tmp_path / 'openmaps.db')).load()
+    monkeypatch.setattr(geocoder, 'get_openmaps_client', lambda config: client)
+    monkeypatch.setattr(geocoder, '_nearby_index', None)
+    monkeypatch.setattr(photos, 'disk_cache', store)
+    monkeypatch.setattr(photos.openmaps_response.cache, 'store', store)
+    monkeypatch.setattr(photos.openmaps_response.cache, '_cache',
+                        collections.OrderedDict())
+    yield client
+    store.close()
@@ -0,0 +1,135 @@
+import os
+import re
+
+"""
+Discovery of the folders to geotag in photos_path (YYYY/YYYY_MM_DD...).
+The tree is walked lazily with os.scandir: folders are yielded as soon as
+they are found, so the processing of the first one starts immediately and
+the memory used doesn't depend on the size of the archive. The metadata
+directories of the NAS (@eaDir, #recycle, .DS_Store...) are skipped
+during the walk.
+Usage:
+    for folder in discovery.walk('/Volumes/photo/', start_year=2018):
+        ...
+    discovery.get_selection(config).walk(config['photos_path'])
+"""
+
+YEAR = re.compile(r'^\d{4}$')
+FOLDER_DATE = re.compile(r'^(\d{4})[_-](\d{2})[_-](\d{2})')
+
+
+def is_hidden(name):
+    """ Synology (@eaDir, @SynoResource, #recycle, #snapshot) and other
+        hidden entries (.DS_Store, ._xxx, .Trashes)
+    """
+    return name.startswith(('@', '#', '.'))
+
+
+def subdirectories(path):
+    """ Returns the sorted (name, path) of the visible subdirectories
+    """
+    with os.scandir(path) as entries:
+        return sorted((entry.name, entry.path) for entry in entries
+                      if not is_hidden(entry.name) and entry.is_dir())
+
+
+def _date(value):
+    """ Returns the 'YYYY_MM_DD' (or 'YYYY-MM-DD') value as a comparable
+        'YYYY_MM_DD' string or None
+    """
+    if value is None:
+        return None
+    match = FOLDER_DATE.match(str(value))
+    if match is None:
+        raise ValueError("Invalid date {}, expected YYYY_MM_DD".format(value))
+    return '_'.join(match.groups())
+
+
+class Selection(object):
+    """Description:
+            Years and folders to check: from start_year (or 'all') to the
+            optional end_year and between the optional start_date and
+            end_date (YYYY_MM_DD, included). The arguments are checked at
+            creation and raise ValueError if invalid.
+
+       Usage:
+            selection = Selection(start_year=2018, end_date='2019_06_30')
+            selection.year('2018'), selection.folder('2018_09_10 Paris')
+            for folder in selection.walk('/Volumes/photo/'): ...
+    """
+    def __init__(self, start_year='all', end_year=None, start_date=None,
+                 end_date=None):
+        self.start_year = None if start_year == 'all' else int(start_year)
+        self.end_year = None if end_year in (None, 'all') else int(end_year)
+        self.start_date = _date(start_date)
+        self.end_date = _date(end_date)
+        if self.start_date is not None:
+            self.start_year = max(self.start_year or 0,
+                                  int(self.start_date[:4]))
+        if self.end_date is not None:
+            self.end_year = min(self.end_year or 9999,
+                                int(self.end_date[:4]))
+
+    def year(self, name):
+        """ Returns True if the year directory has to be checked
+        """
+        if is_hidden(name) or not YEAR.match(name):
+            return False
+        year = int(name)
+        return not (self.start_year is not None and year < self.start_year or
+                    self.end_year is not None and year > self.end_year)
+
+    def folder(self, name):
+        """ Returns True if the folder (in a year directory) has
+            to be checked
+        """
+        if is_hidden(name):
+            return False
+        if self.start_date is None and self.end_date is None:
+            return True
+        match = FOLDER_DATE.match(name)
+        if match is None:
+            return False
+        folder_date = '_'.join(match.groups())
+        return not (
+            self.start_date is not None and folder_date < self.start_date or
+            self.end_date is not None and folder_date > self.end_date)
+
+    def walk(self, root):
+        """ Yields the absolute paths of the folders of the photos tree
+            (root/year/folder), sorted by year and name
+        """
+        for year_name, year_path in subdirectories(root):
+            if not self.year(year_name):
+                continue
+            for folder_name, folder_path in subdirectories(year_path):
+                if self.folder(folder_name):
+                    yield folder_path
+
+
+def get_selection(config):
+    """ Returns the Selection of the start_year, end_year, start_date
+        and end_date settings
+    """
+    return Selection(config.get('start_year', 'all'), config.get('end_year'),
+                     config.get('start_date'), config.get('end_date'))
+
+
+def walk(root, start_year='all', end_year=None, start_date=None,
+         end_date=None):
+    """ Returns a generator of the folders of the photos tree
+
+        Args:
+            root: photos_path, containing the year directories
+            start_year: first year to check or 'all'
+            end_year: last year to check (included) or None
+            start_date: first folder date to check (YYYY_MM_DD) or None
+            end_date: last folder date to check (included) or None
+        Returns:
+            generator of the absolute paths of the folders, sorted by
+            year and name
+        Raises:
+            ValueError if a year or a date is invalid
+    """
+    # Checked here and not on the first iteration of the generator
+    return Selection(start_year, end_year, start_date, end_date).walk(root)
@@ -0,0 +1,251 @@
+import exiftool
+import itertools
+import mmap
+import queue
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import logger
+
+log = logger.generate_logger()
+
+"""
+GPS tags reader for JPEG and TIFF based files (TIFF, DNG, CR2, NEF...).
+Only the EXIF header is read: for JPEG the segments are read one by one
+until the APP1 (Exif) segment, for TIFF the file is mapped in memory and
+only the pages of the IFDs are touched. Other formats (ex. HEIC) return
+None and are left to exiftool.
+Pool of long-lived exiftool processes (-stay_open), shared by all the
+directories. Only the tags needed by the geotagging are extracted and
+exiftool is run with -fast2, so it stops reading the files after the
+metadata header. The files of a directory are split in batches which
+are run in parallel on the free processes.
+"""
+
+GPS_TAGS = [
+    'Composite:GPSLatitude',
+    'Composite:GPSLongitude',
+    'EXIF:DateTimeOriginal'
+    ]
+
+# TIFF tags
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+DATE_TIME_ORIGINAL = 0x9003
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+# TIFF type -> size in bytes
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+
+def _read_ifd(buf, base, offset, order):
+    """ Returns the entries of the IFD at offset as a dictionary
+        tag -> (type, count, raw value)
+    """
+    start = base + offset
+    count, = struct.unpack(order + 'H', buf[start:start + 2])
+    entries = {}
+    for i in range(count):
+        pos = start + 2 + 12 * i
+        tag, tag_type, tag_count = struct.unpack(
+            order + 'HHI', buf[pos:pos + 8])
+        size = TYPE_SIZES.get(tag_type, 1) * tag_count
+        if size <= 4:
+            value = buf[pos + 8:pos + 8 + size]
+        else:
+            value_offset, = struct.unpack(order + 'I', buf[pos + 8:pos + 12])
+            value = buf[base + value_offset:base + value_offset + size]
+        entries[tag] = (tag_type, tag_count, bytes(value))
+    return entries
+
+
+def _pointer(entries, tag, order):
+    if tag not in entries:
+        return None
+    return struct.unpack(order + 'I', entries[tag][2][:4])[0]
+
+
+def _ascii(entries, tag):
+    if tag not in entries:
+        return None
+    return entries[tag][2].split(b'\0')[0].decode('ascii', 'replace')
+
+
+def _degrees(entries, tag, ref_tag, order):
+    if tag not in entries:
+        return None
+    tag_type, tag_count, value = entries[tag]
+    rationals = struct.unpack(order + '6I', value[:24])
+    if 0 in rationals[1::2]:
+        return None
+    degrees, minutes, seconds = [
+        rationals[i] / rationals[i + 1] for i in range(0, 6, 2)]
+    degrees = degrees + minutes / 60 + seconds / 3600
+    if _ascii(entries, ref_tag) in ('S', 'W'):
+        degrees = -degrees
+    return degrees
+
+
+def _parse_tiff(buf, base=0):
+    """ Returns the GPS tags (and the date) from the TIFF structure
+        starting at base, with the same keys as exiftool
+    """
+    order = {b'II': '<', b'MM': '>'}.get(bytes(buf[base:base + 2]))
+    if order is None or struct.unpack(
+      order + 'H', buf[base + 2:base + 4])[0] != 42:
+        return None
+    ifd0 = _read_ifd(
+        buf, base, struct.unpack(order + 'I', buf[base + 4:base + 8])[0],
+        order)
+    tags = {}
+    exif_offset = _pointer(ifd0, EXIF_IFD, order)
+    if exif_offset:
+        date = _ascii(_read_ifd(buf, base, exif_offset, order),
+                      DATE_TIME_ORIGINAL)
+        if date:
+            tags['EXIF:DateTimeOriginal'] = date
+    gps_offset = _pointer(ifd0, GPS_IFD, order)
+    if gps_offset:
+        gps = _read_ifd(buf, base, gps_offset, order)
+        latitude = _degrees(gps, GPS_LATITUDE, GPS_LATITUDE_REF, order)
+        longitude = _degrees(gps, GPS_LONGITUDE, GPS_LONGITUDE_REF, order)
+        if latitude is not None and longitude is not None:
+            tags['Composite:GPSLatitude'] = latitude
+            tags['Composite:GPSLongitude'] = longitude
+    return tags
+
+
+def _read_jpeg(f):
+    """ Reads the JPEG segments until the Exif APP1 segment
+        or the image data
+    """
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        # Standalone markers, without length
+        if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+            continue
+        # Start of scan / end of image: no EXIF metadata
+        if marker[1] in (0xDA, 0xD9):
+            return {}
+        length, = struct.unpack('>H', f.read(2))
+        if marker[1] == 0xE1:
+            segment = f.read(length - 2)
+            if segment[:6] == b'Exif\0\0':
+                return _parse_tiff(segment, 6)
+        else:
+            f.seek(length - 2, 1)
+
+
+def read_gps(path):
+    """ Reads the GPS tags of a JPEG or TIFF file without exiftool
+
+        Args:
+            path: path of the picture
+        Returns:
+            dictionary with the same keys as exiftool ('SourceFile',
+            'Composite:GPSLatitude', 'Composite:GPSLongitude',
+            'EXIF:DateTimeOriginal' if present) or None if the format
+            is not supported or the file could not be parsed
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(8)
+            if header[:2] == b'\xff\xd8':
+                f.seek(2)
+                tags = _read_jpeg(f)
+            elif header[:4] in (b'II*\0', b'MM\0*'):
+                with mmap.mmap(
+                  f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    tags = _parse_tiff(buf)
+            else:
+                return None
+    except (OSError, ValueError, struct.error) as e:
+        log.debug("Cannot read EXIF from {}: {}".format(path, e))
+        return None
+    if tags is None:
+        return None
+    tags['SourceFile'] = path
+    return tags
+
+
+class ExifToolPool(object):
+    """Description:
+            Starts 'workers' exiftool processes. Each batch of files is run
+            on the first free process.
+
+       Usage:
+            pool = ExifToolPool(workers=2, batch_size=256)
+            pool.get_tags(GPS_TAGS, files)
+            pool.close()
+    """
+    def __init__(self, workers=2, batch_size=256, args=('-fast2',)):
+        self._batch_size = batch_size
+        self._args = list(args)
+        self._free = queue.Queue()
+        self._processes = []
+        for _ in range(workers):
+            et = exiftool.ExifTool()
+            et.start()
+            self._processes.append(et)
+            self._free.put(et)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _execute(self, params):
+        et = self._free.get()
+        try:
+            return et.execute_json(*params)
+        finally:
+            self._free.put(et)
+
+    def get_tags(self, tags, files):
+        """ Returns the tags of the files
+
+            Args:
+                tags: list of tags to extract (ex. Composite:GPSLatitude)
+                files: iterable of file paths
+            Returns:
+                list of dictionaries (one per file) having the tags as keys
+        """
+        files = list(files)
+        params = self._args + ['-' + tag for tag in tags]
+        batches = [files[i:i + self._batch_size]
+                   for i in range(0, len(files), self._batch_size)]
+        futures = [self._executor.submit(self._execute, params + batch)
+                   for batch in batches]
+        return list(itertools.chain.from_iterable(
+            future.result() for future in futures))
+
+    def close(self):
+        self._executor.shutdown()
+        for et in self._processes:
+            et.terminate()
+        self._processes = []
+
+
+_exiftool_pool = None
+_exiftool_pool_lock = threading.Lock()
+
+
+def get_exiftool_pool(config):
+    """ Returns the exiftool pool (started once, on first use). A single
+        pool for all the metadata workers
+    """
+    global _exiftool_pool
+    with _exiftool_pool_lock:
+        if _exiftool_pool is None:
+            _exiftool_pool = ExifToolPool(
+                workers=config.get('exiftool_workers', 2),
+                batch_size=config.get('exiftool_batch_size', 256))
+    return _exiftool_pool
+
+
+def close_exiftool_pool():
+    global _exiftool_pool
+    with _exiftool_pool_lock:
+        if _exiftool_pool is not None:
+            _exiftool_pool.close()
+            _exiftool_pool = None
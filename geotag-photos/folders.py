@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 import logger
+import metrics
 import os
 
 log = logger.generate_logger()
+
+# Places with fewer pictures are left out of the folder name
+PLACE_MIN_COUNT = 3
+
 location = {
  "Areas": {
   "Praslin": {
@@ -38,7 +43,8 @@ def _generate_name(locations, directory):
     areas_orig = locations['Areas']
     areas = []
     for area, places_orig in areas_orig.items():
-        places = [place for place, count in places_orig.items() if count >= 3]
+        places = [place for place, count in places_orig.items()
+                  if count >= PLACE_MIN_COUNT]
         if len(places) > 0:
             areas.append(area + ' (' + ', '.join(places) + ')')
         else:
@@ -60,6 +66,7 @@ def _generate_name(locations, directory):
 """
 
 
+@metrics.timed('rename')
 def rename(directory, directory_original_name, location, dry_run=False):
     directory_new_name = _generate_name(location, directory_original_name)
     if directory_new_name is None:
@@ -0,0 +1,525 @@
+import csv
+import email.utils
+import math
+import random
+import threading
+import time
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from fake_useragent import UserAgent
+import logger
+import metrics
+import points
+
+log = logger.generate_logger()
+
+"""
+Reverse geocoders.
+OpenMapsClient calls the OpenMaps API over a pooled HTTP session, from a
+bounded number of threads, limited to a number of requests per second.
+Transient failures (timeouts, connection errors, 429 and 5xx) are retried
+with an exponential backoff honouring Retry-After. A circuit breaker pauses
+all the calls once the API keeps failing, instead of burning through
+thousands of failing requests.
+LocalGeocoder loads a gazetteer extract (OSM/GeoNames style) in a
+grid spatial index and resolves coordinates to the nearest known place,
+without calling the OpenMaps API. NearbyIndex is the same index over the
+points already resolved by the OpenMaps API: a point a few metres away
+from one of them gets its answer without a new call.
+The gazetteer is a CSV file with a header. The 'lat' and 'lon' columns are
+mandatory, all the other columns are used as OpenMaps address keys
+(name, city, town, village, neighbourhood, county, state_district, state,
+country). Ex:
+    lat,lon,name,city,state,country
+    44.4268,26.1025,Piata Unirii,Bucharest,,Romania
+The result of a lookup has the same shape as the OpenMaps jsonv2 response:
+    {'name': 'Piata Unirii',
+     'address': {'city': 'Bucharest', 'country': 'Romania'}}
+"""
+
+EARTH_RADIUS = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ Returns the great circle distance in km between two points
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(
+        lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class LocalGeocoder(object):
+    """Description:
+            Grid index over two arrays of coordinates. Each cell of the grid
+            (cell_size degrees) keeps the indexes of the places inside it.
+            A lookup checks the cells ring by ring around the queried point
+            until no closer place can be found.
+
+       Usage:
+            geocoder = LocalGeocoder('gazetteer.csv', max_distance=5)
+            geocoder.load()
+            geocoder.reverse(44.4268, 26.1025)
+    """
+    def __init__(self, gazetteer_file, max_distance=5, cell_size=0.1):
+        self._gazetteer_file = gazetteer_file
+        self._max_distance = max_distance
+        self._cell_size = cell_size
+        self._lats = array('d')
+        self._lons = array('d')
+        self._records = []
+        self._grid = defaultdict(list)
+
+    def __len__(self):
+        return len(self._records)
+
+    def _cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self._cell_size)),
+                int(math.floor(longitude / self._cell_size)))
+
+    def add(self, latitude, longitude, record):
+        """ Adds a place to the index
+
+            Args:
+                latitude, longitude: coordinates of the place
+                record: tuple of (address key, value) pairs of the place
+        """
+        self._grid[self._cell(latitude, longitude)].append(len(self._records))
+        self._lats.append(latitude)
+        self._lons.append(longitude)
+        self._records.append(record)
+
+    def load(self):
+        # Same address records are shared between the places (ex. all the
+        # places of a city without a name)
+        interned = {}
+        with open(self._gazetteer_file, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    latitude = float(row.pop('lat'))
+                    longitude = float(row.pop('lon'))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                record = tuple(
+                    (key, value) for key, value in row.items() if value)
+                self.add(latitude, longitude,
+                         interned.setdefault(record, record))
+        log.info("Loaded {} places from {}".format(
+            len(self), self._gazetteer_file))
+        return self
+
+    def _ring(self, i, j, r):
+        if r == 0:
+            yield (i, j)
+            return
+        for dj in range(-r, r + 1):
+            yield (i - r, j + dj)
+            yield (i + r, j + dj)
+        for di in range(-r + 1, r):
+            yield (i + di, j - r)
+            yield (i + di, j + r)
+
+    def nearest(self, latitude, longitude):
+        """ Returns the (index, distance in km) of the nearest place within
+            max_distance km or None
+        """
+        i, j = self._cell(latitude, longitude)
+        # Width in km of a cell - any place outside the ring r is
+        # at least r cells away from the queried point
+        step = self._cell_size * KM_PER_DEGREE * max(
+            math.cos(math.radians(latitude)), 0.01)
+        max_ring = int(self._max_distance / step) + 1
+        best = None
+        for r in range(max_ring + 1):
+            for cell in self._ring(i, j, r):
+                for index in self._grid.get(cell, ()):
+                    distance = haversine(
+                        latitude, longitude,
+                        self._lats[index], self._lons[index])
+                    if best is None or distance < best[1]:
+                        best = (index, distance)
+            if best is not None and best[1] <= r * step:
+                break
+        if best is None or best[1] > self._max_distance:
+            return None
+        return best
+
+    def reverse(self, latitude, longitude):
+        """ Returns an OpenMaps-like payload for the nearest place
+            or None if there is no place within max_distance km
+        """
+        nearest = self.nearest(float(latitude), float(longitude))
+        if nearest is None:
+            return None
+        address = dict(self._records[nearest[0]])
+        name = address.pop('name', None)
+        return {'name': name, 'address': address}
+
+
+_local_geocoder = None
+
+
+def get_local_geocoder(config):
+    """ Returns the local geocoder if enabled in the config (loaded once,
+        on first use) or None if the OpenMaps API is used
+    """
+    global _local_geocoder
+    if config.get('geocoder', 'openmaps') != 'local':
+        return None
+    if _local_geocoder is None:
+        _local_geocoder = LocalGeocoder(
+            config['gazetteer_file'],
+            max_distance=config.get('gazetteer_max_distance', 5)).load()
+    return _local_geocoder
+
+
+# Address levels answered by NearbyIndex within admin_radius: all but the
+# neighbourhood (and the name of the place), the city stays the Area
+ADMIN_KEYS = tuple(key for key in points.ADDRESS_KEYS
+                   if key != 'neighbourhood')
+
+
+class NearbyIndex(LocalGeocoder):
+    """Description:
+            Grid index of the points resolved by the OpenMaps API. A point
+            within 'radius' metres of a resolved one gets its answer. If
+            admin_radius is larger, a point within admin_radius metres gets
+            only its city and administrative levels (county, state,
+            country), without the name of the place and its
+            neighbourhood. The answers are interned points.Location
+            records. Thread safe.
+
+       Usage:
+            index = NearbyIndex(radius=25, admin_radius=2000)
+            index.add_payload(44.4268, 26.1025, payload)
+            index.reverse(44.42681, 26.10251)
+    """
+    def __init__(self, radius=25, admin_radius=0, cell_size=0.01):
+        super(NearbyIndex, self).__init__(
+            None, max_distance=max(radius, admin_radius or 0) / 1000.0,
+            cell_size=cell_size)
+        self._radius = radius / 1000.0
+        self._lock = threading.Lock()
+
+    def add_payload(self, latitude, longitude, payload):
+        """ Adds an OpenMaps answer. Answers without result are ignored
+        """
+        if not payload or 'error' in payload:
+            return
+        location = points.locations[points.locations.intern(payload)]
+        with self._lock:
+            self.add(float(latitude), float(longitude), location)
+
+    def seed(self, items):
+        """ Adds the answers of the persistent cache
+
+            Args:
+                items: iterable of ((latitude, longitude[, zoom]), payload)
+        """
+        for args, payload in items:
+            # Coarse answers (with a zoom) don't name the places
+            if len(args) == 2:
+                self.add_payload(args[0], args[1], payload)
+        log.info("Indexed {} resolved points".format(len(self)))
+        return self
+
+    def reverse(self, latitude, longitude):
+        """ Returns an OpenMaps-like payload for the nearest resolved point
+            or None if there is none close enough
+        """
+        with self._lock:
+            nearest = self.nearest(float(latitude), float(longitude))
+        if nearest is None:
+            return None
+        index, distance = nearest
+        location = self._records[index]
+        if distance <= self._radius:
+            metrics.inc('nearby_hits_total', level='place')
+            return location.payload()
+        metrics.inc('nearby_hits_total', level='admin')
+        return {'name': None, 'address': location.address(ADMIN_KEYS)}
+
+
+_nearby_index = None
+_nearby_lock = threading.Lock()
+
+
+def get_nearby_index(config, store=None):
+    """ Returns the NearbyIndex if enabled (nearby_radius or
+        nearby_admin_radius) or None. It's created on first use and seeded
+        with the items() of the persistent store
+    """
+    global _nearby_index
+    radius = config.get('nearby_radius', 0)
+    admin_radius = config.get('nearby_admin_radius', 0)
+    if not radius and not admin_radius:
+        return None
+    with _nearby_lock:
+        if _nearby_index is None:
+            _nearby_index = NearbyIndex(radius or 0, admin_radius)
+            if store is not None:
+                _nearby_index.seed(store.items())
+    return _nearby_index
+
+
+class TokenBucket(object):
+    """Description:
+            Thread safe token bucket. Tokens are refilled at 'rate' per
+            second, up to 'capacity'. acquire() blocks until a token
+            is available.
+    """
+    def __init__(self, rate, capacity=None):
+        self._rate = float(rate)
+        self._capacity = capacity or max(1.0, self._rate)
+        self._tokens = self._capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._capacity,
+                    self._tokens + (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+
+
+def retry_after(response):
+    """ Returns the seconds to wait given by the Retry-After header
+        (seconds or HTTP date) or None
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(
+            value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker(object):
+    """Description:
+            Opens after 'threshold' consecutive failures: wait() then blocks
+            the callers for 'cooldown' seconds. Once elapsed, a single call
+            goes through (half-open). If it succeeds, the breaker is closed,
+            otherwise it's opened again for twice the cooldown (up to
+            max_cooldown).
+
+       Usage:
+            breaker = CircuitBreaker(threshold=5, cooldown=60)
+            breaker.wait()
+            breaker.record(success)
+    """
+    def __init__(self, threshold=5, cooldown=60, max_cooldown=900):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self._current_cooldown = cooldown
+        self._failures = 0
+        # monotonic time until which the breaker is open, None if closed
+        self._opened_until = None
+        self._probing = False
+        self._condition = threading.Condition()
+
+    @property
+    def state(self):
+        with self._condition:
+            if self._opened_until is None:
+                return 'closed'
+            if self._probing or self._opened_until <= time.monotonic():
+                return 'half-open'
+            return 'open'
+
+    def wait(self):
+        """ Blocks while the breaker is open
+        """
+        with self._condition:
+            while self._opened_until is not None:
+                remaining = self._opened_until - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                elif not self._probing:
+                    self._probing = True
+                    return
+                else:
+                    self._condition.wait()
+
+    def record(self, success):
+        with self._condition:
+            if success:
+                if self._opened_until is not None:
+                    log.warning("OpenMaps API is back, resuming")
+                self._failures = 0
+                self._opened_until = None
+                self._probing = False
+                self._current_cooldown = self._cooldown
+                self._condition.notify_all()
+                return
+            self._failures += 1
+            if self._probing:
+                self._current_cooldown = min(
+                    self._current_cooldown * 2, self._max_cooldown)
+            elif (self._opened_until is not None or
+                    self._failures < self._threshold):
+                return
+            self._opened_until = time.monotonic() + self._current_cooldown
+            self._probing = False
+            metrics.inc('circuit_breaker_open_total')
+            log.warning("OpenMaps API failing ({} failures), pausing "
+                        "for {}s".format(self._failures,
+                                         self._current_cooldown))
+            self._condition.notify_all()
+
+
+class OpenMapsClient(object):
+    """Description:
+            OpenMaps API client sharing one keep-alive session (and one
+            User Agent) between all the requests.
+            The requests are limited to 'rate' per second (0 for no limit)
+            and at most 'workers' requests are in flight at the same time.
+            Transient failures are retried up to 'retries' times, waiting
+            backoff * 2^attempt seconds (or Retry-After), at most
+            max_backoff seconds. The optional CircuitBreaker is shared by
+            all the requests.
+
+       Usage:
+            client = OpenMapsClient(base_url, rate=1, workers=4,
+                                    breaker=CircuitBreaker())
+            client.get(44.4268, 26.1025)
+            client.map(function, [(44.4268, 26.1025), (44.4453, 26.0975)])
+    """
+    def __init__(self, base_url, rate=1, workers=4, timeout=30, retries=3,
+                 backoff=1, max_backoff=60, breaker=None):
+        self._base_url = base_url
+        self._workers = workers
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._breaker = breaker
+        self._bucket = TokenBucket(rate) if rate else None
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        # Create a fake User Agent for the requests
+        self._session.headers['User-Agent'] = UserAgent().firefox
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _request(self, params):
+        """ Returns (response or None, transient failure, Retry-After)
+        """
+        if self._bucket is not None:
+            self._bucket.acquire()
+        start = time.monotonic()
+        try:
+            response = self._session.get(
+                url=self._base_url, params=params, timeout=self._timeout)
+            status = str(response.status_code)
+        except requests.exceptions.RequestException as e:
+            log.error(str(e))
+            status = type(e).__name__
+            return None, True, None
+        finally:
+            metrics.observe('http_request_seconds',
+                            time.monotonic() - start, status=status)
+        if response.status_code in TRANSIENT_STATUS:
+            return response, True, retry_after(response)
+        return response, False, None
+
+    def get(self, latitude, longitude, zoom=None):
+        """ Returns the OpenMaps API response for the coordinates (a
+            successful one or a permanent failure, ex. 400) or None if the
+            request still failed after the retries. zoom is the detail
+            level of the answer (3: country ... 10: city ... 18: building,
+            the default)
+        """
+        params = {'lat': latitude, 'lon': longitude}
+        if zoom:
+            params['zoom'] = zoom
+        for attempt in range(self._retries + 1):
+            if self._breaker is not None:
+                self._breaker.wait()
+            response, transient, wait = self._request(params)
+            if self._breaker is not None:
+                self._breaker.record(not transient)
+            if not transient:
+                return response
+            if attempt == self._retries:
+                break
+            # Exponential backoff with jitter, unless the API tells
+            delay = min(self._max_backoff, self._backoff * 2 ** attempt)
+            if wait is None:
+                wait = delay * (0.5 + random.random() / 2)
+            metrics.inc('http_retries_total')
+            time.sleep(min(wait, self._max_backoff))
+        log.error("OpenMaps API failed for {},{} after {} attempts".format(
+            latitude, longitude, self._retries + 1))
+        return None
+
+    def url(self, latitude, longitude, zoom=None):
+        """ Returns the OpenMaps API URL for the coordinates
+        """
+        params = {'lat': latitude, 'lon': longitude}
+        if zoom:
+            params['zoom'] = zoom
+        return requests.Request(
+            'GET', self._base_url, params=params).prepare().url
+
+    def map(self, function, points):
+        """ Calls function(latitude, longitude) for all the points
+            concurrently
+
+            Returns:
+                list of futures, in the order of the points
+        """
+        return [self._executor.submit(function, *point) for point in points]
+
+    def close(self):
+        self._executor.shutdown()
+        self._session.close()
+
+
+_openmaps_client = None
+_openmaps_client_lock = threading.Lock()
+
+
+def get_openmaps_client(config):
+    """ Returns the OpenMaps API client (created once, on first use).
+        A single client, thus a single rate limit, for all the threads
+    """
+    global _openmaps_client
+    with _openmaps_client_lock:
+        if _openmaps_client is None:
+            breaker = None
+            if config.get('openmaps_breaker_threshold', 5):
+                breaker = CircuitBreaker(
+                    config.get('openmaps_breaker_threshold', 5),
+                    config.get('openmaps_breaker_cooldown', 60))
+            _openmaps_client = OpenMapsClient(
+                config['openmaps_base_url'],
+                rate=config.get('openmaps_rate', 1),
+                workers=config.get('openmaps_workers', 4),
+                retries=config.get('openmaps_retries', 3),
+                backoff=config.get('openmaps_backoff', 1),
+                max_backoff=config.get('openmaps_max_backoff', 60),
+                breaker=breaker)
+    return _openmaps_client
@@ -5,6 +5,7 @@ import requests
 import sys
 import time
 import logger
+import metrics
 from config import log
 
 
@@ -38,13 +39,14 @@ def _set_attributes(location_dict, area, *args):
     # Check if argument by argument exists and if so, set the 'Place' 
     # to its value. If not, set it to None
     for place in args:
-        if location_dict[place] is not None: 
+        if location_dict[place] is not None:
             location_dict['Place'] = location_dict[place]
-        return True
+            return True
     location_dict['Place'] = None
     return True
 
 
+@metrics.timed('compute', directory_arg=False)
 def compute(openmaps_response):
     # based on the openmaps_response_json, add results to location dict
     # default attributes which don't exist to None, as there many
@@ -52,6 +54,9 @@ def compute(openmaps_response):
     # just for logic in the set_attributes function the capital Atrributes
     # are the ones needed later
     stored_location = {}
+    # Nominatim answer without result, ex. {'error': 'Unable to geocode'}
+    if 'error' in openmaps_response:
+        return None
 
     _set_dict('name', openmaps_response, '_name', stored_location)
     _set_dict('city', openmaps_response['address'], '_city', stored_location)
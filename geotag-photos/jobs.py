@@ -0,0 +1,244 @@
+import datetime
+import os
+import socket
+import threading
+from pymongo import ReturnDocument, UpdateOne, errors
+import logger
+import metrics
+import mongo
+
+log = logger.generate_logger()
+
+"""
+Distributed processing: several hosts having photos_path mounted geotag
+the folders of a single queue, the 'jobs' collection of the DB. One document
+per folder (_id: the path of the folder):
+    {'state': 'pending' | 'running' | 'done' | 'failed', 'attempts': n,
+     'worker': 'host:pid', 'expires': lease end}
+    - main.py --enqueue adds the folders of get_folders() (the folders
+      done by a previous run are pending again, the checksums in the DB
+      skip the unchanged ones)
+    - main.py --worker claims the folders one at a time with an atomic
+      find_one_and_update: a claimed folder is leased for jobs_lease
+      seconds, renewed by a heartbeat while the worker holds it
+    - the lease of a crashed worker expires and its folders are claimed
+      again by the other workers, up to jobs_max_attempts times
+The paths must be the same on all the hosts (same photos_path mount).
+Usage:
+    queue = jobs.get_queue(config)
+    queue.enqueue(main.get_folders())
+    main.run_pipeline(queue.claimed(), skip_db, job_queue=queue)
+    queue.close()
+"""
+
+
+def worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class JobQueue(object):
+    """Description:
+            Queue of folders in a collection, processed by any number of
+            workers holding leases. The leases of the claimed folders are
+            renewed every lease / 3 seconds by a background thread until
+            the folders are done() or failed().
+
+       Usage:
+            queue = JobQueue('jobs', lease=300)
+            queue.enqueue(folders)
+            for folder in queue.claimed():
+                ...
+                queue.done(folder)
+            queue.close()
+    """
+    def __init__(self, collection='jobs', lease=300, max_attempts=3,
+                 poll_interval=10, worker=None):
+        self._collection = collection
+        self._lease = lease
+        self._max_attempts = max_attempts
+        self._poll_interval = poll_interval
+        self.worker = worker or worker_id()
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def _expires(self):
+        return mongo._utcnow() + datetime.timedelta(seconds=self._lease)
+
+    def enqueue(self, folders, batch_size=100):
+        """ Adds the folders to the queue. The ones already queued are
+            left as they are, unless done or failed: they are pending again
+
+            Returns:
+                number of folders
+        """
+        count = 0
+        batch = []
+        for folder in folders:
+            batch.append(folder)
+            if len(batch) >= batch_size:
+                count += self._enqueue(batch)
+                batch = []
+        if batch:
+            count += self._enqueue(batch)
+        log.info("Enqueued {} folders".format(count))
+        return count
+
+    def _enqueue(self, folders):
+        with mongo.MongoConnector(self._collection) as jobs:
+            jobs.bulk_write([UpdateOne(
+                {'_id': folder},
+                {'$setOnInsert': {'state': 'pending', 'attempts': 0}},
+                upsert=True) for folder in folders], ordered=False)
+            jobs.update_many(
+                {'_id': {'$in': folders}, 'state': {'$in': ['done',
+                                                            'failed']}},
+                {'$set': {'state': 'pending', 'attempts': 0}})
+        return len(folders)
+
+    def claim(self):
+        """ Leases the next pending folder, or a folder whose lease
+            expired
+
+            Returns:
+                the folder or None if none can be claimed now
+        """
+        now = mongo._utcnow()
+        with mongo.MongoConnector(self._collection) as jobs:
+            previous = jobs.find_one_and_update(
+                {'$or': [{'state': 'pending'},
+                         {'state': 'running', 'expires': {'$lt': now}}],
+                 'attempts': {'$lt': self._max_attempts}},
+                {'$set': {'state': 'running', 'worker': self.worker,
+                          'expires': self._expires()},
+                 '$inc': {'attempts': 1}},
+                sort=[('_id', 1)], return_document=ReturnDocument.BEFORE)
+        if previous is None:
+            return None
+        folder = previous['_id']
+        metrics.inc('jobs_claimed_total')
+        if previous['state'] == 'running':
+            log.warning("Lease of {} by {} expired, claimed again".format(
+                folder, previous.get('worker')))
+            metrics.inc('jobs_reclaimed_total')
+        with self._lock:
+            self._held.add(folder)
+        self._start_heartbeat()
+        return folder
+
+    def _fail_exhausted(self):
+        # Folders released or whose lease expired after max_attempts
+        # tries: the folder crashes the workers or can't be processed
+        with mongo.MongoConnector(self._collection) as jobs:
+            result = jobs.update_many(
+                {'$or': [{'state': 'pending'},
+                         {'state': 'running',
+                          'expires': {'$lt': mongo._utcnow()}}],
+                 'attempts': {'$gte': self._max_attempts}},
+                {'$set': {'state': 'failed'}, '$unset': {'expires': ''}})
+        if result.modified_count:
+            log.error("{} folders failed {} times, giving up".format(
+                result.modified_count, self._max_attempts))
+
+    def remaining(self):
+        """ Returns the number of pending folders and of the folders
+            running on the other workers
+        """
+        with mongo.MongoConnector(self._collection) as jobs:
+            return jobs.count_documents(
+                {'$or': [{'state': 'pending'},
+                         {'state': 'running',
+                          'worker': {'$ne': self.worker}}]})
+
+    def claimed(self):
+        """ Yields the claimed folders until no folder is pending or
+            running on another worker. While the other workers hold the
+            last leases, waits poll_interval seconds between the claims:
+            their folders are claimed again if they crash
+        """
+        while not self._stopped.is_set():
+            try:
+                folder = self.claim()
+                if folder is None:
+                    self._fail_exhausted()
+                    if not self.remaining():
+                        return
+                    self._stopped.wait(self._poll_interval)
+                    continue
+            except errors.PyMongoError as e:
+                log.error("Can't claim a folder: {}".format(e))
+                self._stopped.wait(self._poll_interval)
+                continue
+            yield folder
+
+    def _finish(self, folder, update):
+        with self._lock:
+            self._held.discard(folder)
+        try:
+            with mongo.MongoConnector(self._collection) as jobs:
+                result = jobs.update_one(
+                    {'_id': folder, 'worker': self.worker,
+                     'state': 'running'}, update)
+        except errors.PyMongoError as e:
+            log.error(str(e))
+            return
+        if not result.matched_count:
+            log.warning("Lease of {} lost, it was claimed by another "
+                        "worker".format(folder))
+
+    def done(self, folder):
+        self._finish(folder, {'$set': {'state': 'done'},
+                              '$unset': {'expires': ''}})
+
+    def failed(self, folder):
+        """ Releases the folder, to be tried again (up to max_attempts)
+        """
+        self._finish(folder, {'$set': {'state': 'pending'},
+                              '$unset': {'worker': '', 'expires': ''}})
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is not None:
+                return
+            self._heartbeat = threading.Thread(
+                target=self._beat, name='jobs-heartbeat', daemon=True)
+            self._heartbeat.start()
+
+    def _beat(self):
+        while not self._stopped.wait(self._lease / 3.0):
+            self.heartbeat()
+
+    def heartbeat(self):
+        """ Renews the leases of the held folders
+        """
+        with self._lock:
+            held = list(self._held)
+        if not held:
+            return
+        try:
+            with mongo.MongoConnector(self._collection) as jobs:
+                jobs.update_many(
+                    {'_id': {'$in': held}, 'worker': self.worker,
+                     'state': 'running'},
+                    {'$set': {'expires': self._expires()}})
+        except errors.PyMongoError as e:
+            log.error("Heartbeat failed: {}".format(e))
+
+    def close(self):
+        """ Stops the heartbeat and releases the folders still held (their
+            processing failed or was interrupted)
+        """
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        with self._lock:
+            held = list(self._held)
+        for folder in held:
+            self.failed(folder)
+
+
+def get_queue(config):
+    return JobQueue('jobs', lease=config.get('jobs_lease', 300),
+                    max_attempts=config.get('jobs_max_attempts', 3),
+                    poll_interval=config.get('jobs_poll_interval', 10))
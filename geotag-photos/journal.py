@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import logger
+import manifest
+
+log = logger.generate_logger()
+
+"""
+Run journal, to resume a run that crashed or was killed. It's an append-only
+file of JSON lines, written as the run goes:
+    {"folder": path, "checksum": ..., "locations": ...}
+        once a folder is stored and renamed
+    {"cache": [lat, lon], "value": payload[, "ttl": seconds]}
+        for each new OpenMaps response
+With --resume, the completed folders are skipped (unless they changed since,
+their checksum is compared) and the cache entries are replayed, so nothing is
+geocoded again. A line cut by the crash is ignored.
+In --watch mode, the journal is compacted after each cycle: only the last
+entry of each folder is kept, the OpenMaps responses are in the cache_file.
+Usage:
+    journal = Journal('journal.jsonl').start(resume=True)
+    journal.replay(photos.openmaps_response.cache)
+    journal.attach(photos.openmaps_response.cache)
+    folders_to_check = journal.pending(folders_to_check)
+    journal.folder_done(folder, checksum, locations)
+    journal.compact()
+"""
+
+
+class _JournaledStore(object):
+    """ Persistent store of a Cache also writing the new entries
+        to the journal
+    """
+    def __init__(self, store, journal):
+        self._store = store
+        self._journal = journal
+
+    def get(self, args):
+        return self._store.get(args) if self._store is not None else None
+
+    def set(self, args, value, ttl=None):
+        if self._store is not None:
+            self._store.set(args, value, ttl)
+        self._journal.cache_set(args, value, ttl)
+
+
+class Journal(object):
+    """Description:
+            Append-only journal of a run: completed folders and new
+            cache entries.
+
+       Usage:
+            journal = Journal('journal.jsonl').start(resume=False)
+            journal.attach(cache)
+            journal.folder_done(folder, checksum, locations)
+            journal.close()
+    """
+    def __init__(self, journal_file):
+        self._journal_file = journal_file
+        self._file = None
+        self._lock = threading.Lock()
+        # folder -> {'checksum', 'locations'}
+        self.completed = {}
+        self.cache_entries = []
+
+    def load(self):
+        """ Reads the journal of the previous run
+        """
+        self.completed = {}
+        self.cache_entries = []
+        if not os.path.exists(self._journal_file):
+            return self
+        with open(self._journal_file, 'r') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    log.warning("Ignoring line {} of {}".format(
+                        number, self._journal_file))
+                    continue
+                if 'folder' in entry:
+                    self.completed[entry['folder']] = {
+                        'checksum': entry.get('checksum'),
+                        'locations': entry.get('locations')}
+                elif 'cache' in entry:
+                    self.cache_entries.append((tuple(entry['cache']),
+                                               entry['value'],
+                                               entry.get('ttl')))
+        return self
+
+    def start(self, resume=False):
+        """ Opens the journal: appends to the previous one to resume it,
+            otherwise starts a new one
+        """
+        if resume:
+            self.load()
+            log.warning("Resuming: {} folders completed, {} cache "
+                        "entries".format(len(self.completed),
+                                         len(self.cache_entries)))
+        self._file = open(self._journal_file, 'a' if resume else 'w')
+        if resume and self._file.tell() > 0:
+            # The line cut by the crash must not swallow the next entry
+            with open(self._journal_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write('\n')
+        return self
+
+    def _append(self, entry, sync=False):
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def cache_set(self, args, value, ttl=None):
+        entry = {'cache': list(args), 'value': value}
+        if ttl:
+            entry['ttl'] = ttl
+        self._append(entry)
+
+    def folder_done(self, folder, checksum, locations):
+        # Synced: the folder (and the cache entries before it)
+        # must not be processed again
+        self._append({'folder': folder, 'checksum': checksum,
+                      'locations': locations}, sync=True)
+        with self._lock:
+            self.completed[folder] = {'checksum': checksum,
+                                      'locations': locations}
+
+    def compact(self):
+        """ Rewrites the journal with only the last entry of each completed
+            folder. The cache entries are dropped: once a run or a watch
+            cycle is over, they are in the persistent store of the cache
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self.cache_entries = []
+            with open(self._journal_file + '.tmp', 'w') as f:
+                for folder, entry in self.completed.items():
+                    f.write(json.dumps(dict(entry, folder=folder)) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self._journal_file + '.tmp', self._journal_file)
+            self._file = open(self._journal_file, 'a')
+
+    def attach(self, cache):
+        """ Journals the new entries of the cache (cache.Cache)
+        """
+        cache.store = _JournaledStore(cache.store, self)
+
+    def replay(self, cache):
+        """ Adds the cache entries of the previous run to the cache
+            (in memory and in its persistent store)
+        """
+        for args, value, ttl in self.cache_entries:
+            if cache.store is not None:
+                cache.store.set(args, value, ttl)
+            cache.put(args, value, ttl)
+
+    def pending(self, folders_to_check):
+        """ Yields the folders not completed by the previous run, or
+            changed since (their checksum is different)
+        """
+        skipped = 0
+        for folder in folders_to_check:
+            completed = self.completed.get(folder)
+            if completed is not None:
+                try:
+                    checksum = manifest.checksum(manifest.scan(folder))
+                except OSError:
+                    checksum = None
+                if checksum == completed['checksum']:
+                    skipped += 1
+                    continue
+            yield folder
+        if skipped:
+            log.info("Skipped {} completed folders".format(skipped))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
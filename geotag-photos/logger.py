@@ -1,19 +1,9 @@
 import logging
-import yaml
-import sys
-
-
-def load_config():
-    try:
-        with open('config.yaml', 'r') as fh:
-            config = yaml.load(fh)
-            return config
-    except FileNotFoundError:
-        sys.exit(1)
 
 
 def generate_logger():
-    config = load_config()
+    # Imported here: config itself logs through this module
+    from config import config
     level = 'logging.' + config['log_level']
     filename = config['log_filename'] or None
 
@@ -1,16 +1,25 @@
 #!/usr/bin/env python
 
-import glob
+import argparse
 import yaml
 import os.path
 import sys
 import json
 import itertools
+import journal
+import jobs
+import prefetch
 
+import discovery
 import photos
 import folders
-from cache import DiskCache
-from config import logger, config, mongo, cache
+import exif
+import mongo
+import metrics
+import watch
+import writebehind
+from pipeline import Pipeline, Stage
+from config import log, config, check_db
 
 
 """
@@ -21,47 +30,163 @@ This is configurable in the vars.yaml file in start_year
 """
 
 
-def filter(year):
-    return [fn for fn in glob.iglob(
-        "{}/*".format(year)) if not os.path.basename(fn).startswith('@eaDir')]
-    # itertools.chain.from_iterable() - will be used to flatten the list later.
-    # ie. combining all folders from all years in a single list
-
-
 def get_folders():
+    """ Returns a generator of the folders to check, walking photos_path
+        lazily from start_year (or 'all') to the optional end_year and
+        between the optional start_date and end_date (YYYY_MM_DD)
+
+        Raises:
+            OSError if photos_path is not reachable
+    """
     if not os.path.isdir(config['photos_path']):
         raise OSError
-    if config['start_year'] == 'all':
-        years = glob.glob("{}20*".format(config['photos_path']))
-        folders_tbc = [glob.glob(filter(year)) for year in years]
-        return list(itertools.chain.from_iterable(folders_tbc))
-
-    # First extract all year folders and convert them in int
-    # in order to compare with the start_year var
-    all_years_folders = [int(os.path.basename(i)) for i in glob.glob(
-        "{}/20*".format(config['photos_path']))]
     try:
-        int_years_tbc = [year for year in all_years_folders if year >= int(
-            config['start_year'])]
+        return discovery.get_selection(config).walk(config['photos_path'])
     except ValueError:
         sys.exit(1)
 
-    years_tbc = [config['photos_path'] + str(year) for year in int_years_tbc]
-    folders_tbc = [(filter(year)) for year in years_tbc]
-    return list(itertools.chain.from_iterable(folders_tbc))
 
+def load_records(folders_to_check, records, batch_size=100):
+    """ Loads the DB records of the folders in batches, while they are
+        discovered, before yielding them
+
+        Args:
+            folders_to_check: iterable of absolute paths of the folders
+            records: dictionary updated with the loaded records
+            batch_size: number of folders per query
+        Yields:
+            the folders
+    """
+    batch = []
+    for folder in itertools.chain(folders_to_check, [None]):
+        if folder is not None:
+            batch.append(folder)
+            if len(batch) < batch_size:
+                continue
+        if batch:
+            records.update(mongo.load_directories(
+                os.path.basename(folder) for folder in batch))
+        yield from batch
+        batch = []
+
+
+def run_pipeline(folders_to_check, skip_db, run_journal=None,
+                 job_queue=None):
+    """ Geotags and renames the folders in a pipeline with the stages:
+        metadata extraction (manifest, DB check and reading the new files),
+        geocoding (OpenMaps API calls) and a single writer queuing the
+        results to the write-behind thread (DB store and rename, see
+        writebehind.py). The number of workers per stage is configurable.
+
+        Args:
+            folders_to_check: iterable of absolute paths of the folders
+            skip_db: don't check or store results in the DB
+            run_journal: journal.Journal recording the completed folders
+            job_queue: jobs.JobQueue of the claimed folders
+        Returns:
+            number of processed folders
+    """
+    records = None
+    if not skip_db:
+        # Checksums of the folders loaded in one query per batch of
+        # discovered folders. The claimed folders are not held in a batch:
+        # claimed() waits for the folders of the other workers, which may
+        # wait for ours
+        records = {}
+        batch_size = config.get('mongo_batch_size', 100)
+        if job_queue is not None:
+            batch_size = 1
+        folders_to_check = load_records(folders_to_check, records, batch_size)
+    # Records written in batches, out of the pipeline
+    persister = writebehind.WriteBehind(
+        config.get('mongo_batch_size', 100),
+        config.get('write_behind_queue_size', 1000))
+
+    def extract(folder):
+        job = photos.scan_dir(folder, skip_db, records)
+        job['folder'] = folder
+        if not job['cached']:
+            job['metadata'] = photos.get_metadata(folder, job['files'])
+        return job
+
+    def geocode(job):
+        if not job['cached']:
+            job['locations'], job['metadata'], job['openmaps_urls'] = \
+                photos.update_locations(job['folder'], job, job['metadata'])
+        return job
+
+    def dropped(item):
+        # Failed in a stage: claimed again by a worker (up to
+        # jobs_max_attempts times), not held until the end of the run
+        if job_queue is not None:
+            job_queue.failed(item['folder'] if isinstance(item, dict)
+                             else item)
+
+    def write(job):
+        folder = job['folder']
+        folder_original_name, folder_date, folder_base = \
+            photos.directory_names(folder)
+        requests = None
+        if not skip_db and not job['cached']:
+            requests = photos.db_requests(
+                folder_date, folder_base, job['checksum'], job['metadata'],
+                job['openmaps_urls'], job['locations'], job['manifest'])
+
+        # Once the folder is stored. If it couldn't be, it's neither
+        # renamed nor completed: the next run (or worker) does it again
+        def done(written):
+            if not written:
+                if job_queue is not None:
+                    job_queue.failed(folder)
+                return
+            folders.rename(folder, folder_original_name, job['locations'],
+                           dry_run=True)
+            if run_journal is not None:
+                run_journal.folder_done(
+                    folder, job['checksum'], job['locations'])
+            if job_queue is not None:
+                job_queue.done(folder)
+
+        persister.submit(folder, requests, done)
+
+    pipeline = Pipeline([
+        Stage('metadata', extract, config.get('metadata_workers', 2),
+              on_error=dropped),
+        Stage('geocoding', geocode, config.get('geocoding_workers', 2),
+              on_error=dropped),
+        Stage('writer', write, on_error=dropped)
+        ], queue_size=config.get('pipeline_queue_size', 16))
+    try:
+        return pipeline.run(folders_to_check)
+    finally:
+        persister.close()
 
-def rename_folder(folder, skip_db, openmaps_cache):
-    folder_original_name, location, openmaps_cache \
-        = photos.geotag_dir(folder, skip_db, openmaps_cache)
-    folders.rename(folder, folder_original_name, location, dry_run=True)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the folders completed by the previous "
+                        "run and reuse its geocoding results")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="geocode the places of all the folders first, "
+                        "each place once")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and geotag the new or changed "
+                        "folders of photos_path")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="add the folders to the jobs queue of the DB "
+                        "for the workers")
+    parser.add_argument("--worker", action="store_true",
+                        help="geotag the folders of the jobs queue of the "
+                        "DB, with the workers of the other hosts")
+    parser.add_argument("--skipdb", action="store_true",
+                        help="don't check or store the folders in the DB")
+    args = parser.parse_args()
     try:
         folders_to_check = get_folders()
-        skip_db = False
-        if not mongo:
-            log.error("DB error: {}".format(e))
+        skip_db = args.skipdb
+        if not skip_db and not check_db():
+            log.error("DB not reachable, results won't be stored")
             skip_db = True
     except OSError as e:
         log.error(
@@ -69,13 +194,58 @@ if __name__ == "__main__":
                 config['photos_path']))
         sys.exit(e.errno)
 
-    # disk_cache = DiskCache(config['cache_file'])
-    # openmaps_cache = disk_cache.load()
-    loaded_cache = cache.load()
-    skip_db = True
-    for folder in folders_to_check:
-        rename_folder(folder, skip_db, loaded_cache)
-    # Write to DiskCache
-    cache.persist()
+    job_queue = None
+    if args.enqueue or args.worker:
+        if not check_db():
+            log.error("DB not reachable, no jobs queue")
+            sys.exit(1)
+        job_queue = jobs.get_queue(config)
+        if args.enqueue:
+            job_queue.enqueue(folders_to_check)
+            if not args.worker:
+                mongo.close_client()
+                sys.exit(0)
+        # The workers geotag the folders they claim and store the results
+        folders_to_check, skip_db = job_queue.claimed(), False
+    run_journal = journal.Journal(
+        config.get('journal_file', 'journal.jsonl')).start(args.resume)
+    # Replayed before being attached, not to journal the entries again
+    run_journal.replay(photos.openmaps_response.cache)
+    run_journal.attach(photos.openmaps_response.cache)
+    # The jobs queue keeps track of the completed folders of the workers
+    if args.resume and job_queue is None:
+        folders_to_check = run_journal.pending(folders_to_check)
+    if args.prefetch:
+        # The folders are walked twice: once to gather their points
+        prefetch_folders, records = get_folders(), None
+        if args.resume:
+            prefetch_folders = run_journal.pending(prefetch_folders)
+        if not skip_db:
+            records = {}
+            prefetch_folders = load_records(
+                prefetch_folders, records,
+                config.get('mongo_batch_size', 100))
+        prefetch.run(prefetch_folders, skip_db, records)
+    run_pipeline(folders_to_check, skip_db, run_journal, job_queue)
+    if job_queue is not None:
+        job_queue.close()
+    metrics.export(config)
+    if args.watch:
+        def process(changed_folders):
+            run_pipeline(changed_folders, skip_db, run_journal)
+            # Only the last entry of each folder is kept
+            run_journal.compact()
+            metrics.export(config)
+
+        run_journal.compact()
+
+        # The exiftool workers, HTTP session, Mongo client and caches
+        # stay open between the events
+        watch.get_daemon(config, process).run()
+    run_journal.close()
+    # DiskCache entries are written as they arrive, just close it
+    photos.disk_cache.close()
+    exif.close_exiftool_pool()
+    mongo.close_client()
 
     # add force argument for geotag_dir
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+
+"""
+Manifest of a directory: name, size, modification time (ns) and inode of
+each file, read with a single os.scandir (no need to open the files).
+It is stored with the directory record in the DB (as a list, since file
+names contain dots which can't be used as Mongo keys) and compared with
+the current one to find the files added since the last run.
+"""
+
+
+def scan(directory):
+    """ Returns the manifest of the directory
+
+        Args:
+            directory: full path of the directory
+        Returns:
+            dictionary having the file names as keys and
+            [size, mtime_ns, inode] as values
+    """
+    files_manifest = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            files_manifest[entry.name] = [
+                stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    return files_manifest
+
+
+def to_list(files_manifest):
+    """ Returns the manifest as a list of [name, size, mtime_ns, inode]
+        sorted by name, as stored in the DB
+    """
+    return [[name] + files_manifest[name] for name in sorted(files_manifest)]
+
+
+def from_list(entries):
+    return {entry[0]: list(entry[1:]) for entry in entries or []}
+
+
+def checksum(files_manifest):
+    """ Returns the checksum of the directory computed as the md5 of the
+        manifest. Any added, removed or modified file changes it
+    """
+    return hashlib.md5(json.dumps(
+        to_list(files_manifest)).encode('utf-8')).hexdigest()
+
+
+def added_files(old_entries, files_manifest):
+    """ Compares the manifest stored in the DB with the current one
+
+        Args:
+            old_entries: manifest stored in the DB (list) or None
+            files_manifest: current manifest
+        Returns:
+            sorted list of the names of the files added since the stored
+            manifest or None if files were removed or modified (or if there
+            is no stored manifest) and the whole directory must be read
+    """
+    if not old_entries:
+        return None
+    old_manifest = from_list(old_entries)
+    for name, stat in old_manifest.items():
+        if files_manifest.get(name) != stat:
+            return None
+    return sorted(name for name in files_manifest if name not in old_manifest)
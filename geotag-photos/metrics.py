@@ -0,0 +1,230 @@
+import bisect
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+import logger
+
+log = logger.generate_logger()
+
+"""
+Run metrics: time histograms per stage (and total time per directory),
+counters (pictures, HTTP requests by status...) and the counters of the
+registered caches. At the end of the run they can be exported as a
+Prometheus textfile (for the node_exporter textfile collector) and as a
+JSON summary including the slowest directories.
+Usage:
+    @metrics.timed('metadata')
+    def get_metadata(directory): ...
+
+    with metrics.timer('rename', directory): ...
+    metrics.inc('pictures_total', 10)
+    metrics.export(config)
+"""
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+           60, 300)
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """ Returns the (upper bound, cumulative count) of the buckets
+        """
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics(object):
+    """Description:
+            Thread safe registry of histograms and counters. Metrics are
+            identified by name and a tuple of (label, value) pairs.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caches = {}
+        self.reset()
+
+    def reset(self):
+        """ Starts a new run. The registered caches are kept
+        """
+        with self._lock:
+            self.start = time.monotonic()
+            self._histograms = defaultdict(Histogram)
+            self._counters = defaultdict(float)
+            self._directories = defaultdict(float)
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self._histograms[(name, tuple(sorted(labels.items())))].observe(
+                value)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def add_directory_time(self, directory, seconds):
+        with self._lock:
+            self._directories[directory] += seconds
+
+    def register_cache(self, name, cache):
+        """ Registers an object having cache_info() (ex. cache.Cache)
+        """
+        self._caches[name] = cache
+
+    def slowest(self, count=10):
+        with self._lock:
+            directories = sorted(self._directories.items(),
+                                 key=lambda item: item[1], reverse=True)
+        return [(directory, round(seconds, 3))
+                for directory, seconds in directories[:count]]
+
+    def _cache_counters(self):
+        counters = {}
+        for name, cache in self._caches.items():
+            for key, value in cache.cache_info().items():
+                counters[('cache_' + key, (('cache', name),))] = value
+        return counters
+
+    def prometheus(self, prefix='geotag_'):
+        """ Returns the metrics in the Prometheus text format
+        """
+        def labels_text(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(
+                key, str(value).replace('"', '\\"'))
+                for key, value in labels) + '}'
+
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        counters += sorted(self._cache_counters().items())
+        counters.append((('run_seconds', ()), time.monotonic() - self.start))
+        typed = set()
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append('# TYPE {}{} histogram'.format(prefix, name))
+                typed.add(name)
+            for bound, count in histogram.cumulative():
+                lines.append('{}{}_bucket{} {}'.format(
+                    prefix, name, labels_text(labels, [('le', bound)]),
+                    count))
+            lines.append('{}{}_sum{} {}'.format(
+                prefix, name, labels_text(labels), histogram.sum))
+            lines.append('{}{}_count{} {}'.format(
+                prefix, name, labels_text(labels), histogram.count))
+        for (name, labels), value in counters:
+            if name not in typed:
+                # The *_total counters only increase
+                lines.append('# TYPE {}{} {}'.format(
+                    prefix, name,
+                    'counter' if name.endswith('_total') else 'gauge'))
+                typed.add(name)
+            lines.append('{}{}{} {}'.format(
+                prefix, name, labels_text(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, slowest=10):
+        """ Returns the run summary as a dictionary
+        """
+        seconds = time.monotonic() - self.start
+        with self._lock:
+            stages = {}
+            for (name, labels), histogram in self._histograms.items():
+                key = name + ''.join(
+                    '[{}={}]'.format(*label) for label in labels)
+                stages[key] = {
+                    'count': histogram.count,
+                    'seconds': round(histogram.sum, 3),
+                    'average': round(histogram.sum / histogram.count, 4)
+                    if histogram.count else None
+                    }
+            counters = {name + ''.join(
+                '[{}={}]'.format(*label) for label in labels): value
+                for (name, labels), value in self._counters.items()}
+        pictures = counters.get('pictures_total', 0)
+        return {
+            'seconds': round(seconds, 3),
+            'pictures_per_second': round(pictures / seconds, 2)
+            if seconds else None,
+            'stages': stages,
+            'counters': counters,
+            'caches': {name: cache.cache_info()
+                       for name, cache in self._caches.items()},
+            'slowest_directories': self.slowest(slowest)
+            }
+
+
+registry = Metrics()
+observe = registry.observe
+inc = registry.inc
+register_cache = registry.register_cache
+
+
+@contextlib.contextmanager
+def timer(stage, directory=None):
+    """ Records the elapsed time in the stage_seconds histogram and,
+        if given, in the total time of the directory
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        registry.observe('stage_seconds', elapsed, stage=stage)
+        if directory is not None:
+            registry.add_directory_time(directory, elapsed)
+
+
+def timed(stage, directory_arg=True):
+    """ Decorator timing the function as a stage. If directory_arg is set,
+        the first argument of the function is the directory
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            directory = args[0] if directory_arg and args else None
+            with timer(stage, directory):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export(config):
+    """ Writes the Prometheus textfile (metrics_prometheus_file) and the
+        JSON summary (metrics_summary_file) if configured and logs
+        the slowest directories
+    """
+    summary = registry.summary(config.get('metrics_slowest', 10))
+    outputs = [(config.get('metrics_prometheus_file'), registry.prometheus()),
+               (config.get('metrics_summary_file'),
+                json.dumps(summary, indent=1))]
+    for filename, content in outputs:
+        if not filename:
+            continue
+        # Written atomically, the textfile collector may read it any time
+        with open(filename + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(filename + '.tmp', filename)
+    log.info("Run took {}s ({} pictures/s). Slowest directories: {}".format(
+        summary['seconds'], summary['pictures_per_second'],
+        summary['slowest_directories']))
+    return summary
@@ -1,13 +1,84 @@
 #!/usr/bin/env python
 
-import yaml
-from pymongo import MongoClient
+import datetime
+import threading
+import time
+from collections import defaultdict
+from pymongo import MongoClient, ASCENDING, errors
+import logger
+from cache import normalize_key
+from config import config, check_db
+
+log = logger.generate_logger()
+
+"""
+A single MongoClient (which keeps its own connection pool and is thread
+safe) is shared by the whole process. It is created on first use and
+closed by close_client().
+Collections:
+    metadata: one small summary document per directory
+    pictures: one document per picture with just the fields we use
+    geocode_cache: OpenMaps responses shared by all the hosts, keyed
+        (_id) by the normalized coordinates. Documents having an 'expires'
+        date are removed by a TTL index
+    jobs: folders geotagged by the workers of all the hosts, see jobs.py
+"""
+
+_client = None
+_client_lock = threading.Lock()
+
+# Collection -> list of (keys, index options)
+INDEXES = {
+    'metadata': [([('date', ASCENDING)], {'unique': True})],
+    'pictures': [([('directory', ASCENDING), ('file', ASCENDING)],
+                  {'unique': True})],
+    'geocode_cache': [([('expires', ASCENDING)], {'expireAfterSeconds': 0})],
+    'jobs': [([('state', ASCENDING), ('_id', ASCENDING)], {})]
+    }
+
+
+def get_collection(name='metadata'):
+    """ Returns a collection of the 'photos' DB of the shared client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            mongo_uri = 'mongodb://{}:{}@{}/{}'.format(
+                        config['mongo_user'],
+                        config['mongo_pass'],
+                        config['mongo_host'],
+                        config['mongo_db']
+                        )
+            client = MongoClient(
+                mongo_uri, serverSelectionTimeoutMS=config.get(
+                    'mongo_timeout_ms', 5000))
+            # Shared only once the indexes exist: if the DB isn't
+            # reachable yet, the next call tries again
+            try:
+                for collection, indexes in INDEXES.items():
+                    for keys, options in indexes:
+                        client.photos[collection].create_index(
+                            keys, **options)
+            except Exception:
+                client.close()
+                raise
+            _client = client
+    return _client.photos[name]
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
 
 
 class MongoConnector():
     """Description:
             Implements Context managers, by specifying __enter__ and __exit__
-            The DB name 'photos' and collection name 'metadata' are hardcoded!
+            The DB name 'photos' is hardcoded! The collection is 'metadata'
+            by default. The connection is shared, it is not closed on exit.
 
        Usage:
             mongo = MongoConnector()
@@ -17,21 +88,121 @@ class MongoConnector():
        Raises:
 
     """
-    def __init__(self):
-        with open('config.yaml', 'rt') as f:
-            config = yaml.load(f)
-        self.mongo_uri = 'mongodb://{}:{}@{}/{}'.format(
-                    config['mongo_user'],
-                    config['mongo_pass'],
-                    config['mongo_host'],
-                    config['mongo_db']
-                    )
+    def __init__(self, collection='metadata'):
+        self._collection = collection
 
     def __enter__(self):
-        # try:
-        self.connector = MongoClient(self.mongo_uri)
-        self.connector.photos.metadata.ensure_index('date', unique=True)
-        return self.connector.photos.metadata
+        return get_collection(self._collection)
 
     def __exit__(self, type, value, tb):
-        self.connector.close()
\ No newline at end of file
+        pass
+
+
+def load_directories(directories):
+    """ Loads the checksum and the locations of the directories
+        in a single query
+
+        Args:
+            directories: basenames of the directories
+        Returns:
+            dictionary having the directories as keys and their
+            record ('directory', 'directory_checksum', 'locations') as values
+    """
+    with MongoConnector() as mongo:
+        cursor = mongo.find(
+            {'directory': {'$in': list(directories)}},
+            {'_id': 0, 'directory': 1, 'directory_checksum': 1,
+             'locations': 1})
+        return {record['directory']: record for record in cursor}
+
+
+def write(requests):
+    """ Runs the write requests with one bulk_write per collection. The
+        'metadata' records (holding the checksums) are written last: if
+        the pictures can't be written, the directories are not seen as
+        up to date by the next run
+
+        Args:
+            requests: list of (collection name, pymongo write operation)
+    """
+    by_collection = defaultdict(list)
+    for collection, request in requests:
+        by_collection[collection].append(request)
+    for collection in sorted(by_collection, key=lambda c: c == 'metadata'):
+        with MongoConnector(collection) as mongo:
+            mongo.bulk_write(by_collection[collection], ordered=False)
+
+
+def _utcnow():
+    # Dates are stored and read back as naive UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class MongoCache(object):
+    """Description:
+            Persistent store of a Cache (see cache.TieredStore) in a
+            collection shared by all the hosts. Values are stored with an
+            optional expiration (ttl, or 'ttl' seconds by default).
+            If the DB isn't reachable, the store is disabled and errors
+            are logged as misses: the shared cache is never required.
+            After an error, the store is skipped for 'cooldown' seconds,
+            not to wait for the DB timeout on every miss.
+
+       Usage:
+            shared_cache = MongoCache('geocode_cache', ttl=None)
+            shared_cache.set((44.4268, 26.1025), payload)
+            shared_cache.get((44.4268, 26.1025))
+    """
+    def __init__(self, collection='geocode_cache', ttl=None, cooldown=60):
+        self._collection = collection
+        self._ttl = ttl
+        self._cooldown = cooldown
+        self._enabled = None
+        self._retry_at = 0
+
+    def _available(self):
+        if self._enabled is None:
+            self._enabled = check_db()
+            if not self._enabled:
+                log.warning("DB not reachable, the shared {} is "
+                            "disabled".format(self._collection))
+        return self._enabled and time.monotonic() >= self._retry_at
+
+    def _failed(self, error):
+        if time.monotonic() >= self._retry_at:
+            log.error("Shared {} skipped for {}s: {}".format(
+                self._collection, self._cooldown, error))
+        self._retry_at = time.monotonic() + self._cooldown
+
+    def get(self, args):
+        if not self._available():
+            return None
+        try:
+            with MongoConnector(self._collection) as mongo:
+                record = mongo.find_one({'_id': normalize_key(args)},
+                                        {'value': 1, 'expires': 1})
+        except errors.PyMongoError as e:
+            self._failed(e)
+            return None
+        # The TTL monitor runs only every minute
+        if record is None or record.get('expires') and \
+                record['expires'] < _utcnow():
+            return None
+        return record['value']
+
+    def set(self, args, value, ttl=None):
+        if not self._available():
+            return
+        ttl = ttl or self._ttl
+        update = {'$set': {'value': value}}
+        if ttl:
+            update['$set']['expires'] = _utcnow() + datetime.timedelta(
+                seconds=ttl)
+        else:
+            update['$unset'] = {'expires': ''}
+        try:
+            with MongoConnector(self._collection) as mongo:
+                mongo.update_one(
+                    {'_id': normalize_key(args)}, update, upsert=True)
+        except errors.PyMongoError as e:
+            self._failed(e)
@@ -1,6 +1,6 @@
 #!/usr/local/bin/python3
 
-import exiftool
+import exif
 import yaml
 import json
 import os
@@ -12,112 +12,266 @@ import argparse
 import re
 import hashlib
 import geolocation
+import geocoder
+import cluster
+import manifest
+import metrics
 import folders
 import requests
 import time
 import logging
-from fake_useragent import UserAgent
-from cache import Cache, DiskCache
-from mongo import MongoConnector
+from cache import Cache, DiskCache, TieredStore
+import zlib
+from mongo import MongoConnector, MongoCache, write as mongo_write
+from points import PointStore
 from pymongo import errors as pymongo_errors
+from pymongo import UpdateOne, ReplaceOne, DeleteMany
+from bson.binary import Binary
 from requests import HTTPError
 from bson import json_util
 from collections import defaultdict, Counter, deque
-from config import log, cache
+from config import log, config
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
-def load_config():
-    try:
-        with open('config.yaml', 'r') as fh:
-            config = yaml.load(fh)
-            return config
-    except FileNotFoundError:
-        sys.exit(1)
+# Opened on its first lookup
+disk_cache = DiskCache(config.get('cache_file', 'cache.db'))
 
 
-def compute_checksum(directory):
-    """ Returns the checksum of the directory computed by calculating
-    the md5 of "ls -t". (Since the computing and aggregation of checksum for
-    all files in the directory is to expensive, then dirhash will not be used)
+def negative_ttl(payload):
+    """ TTL of the OpenMaps answers without result ({'error': ...}),
+        which are cached for negative_cache_ttl seconds only
+    """
+    if 'error' in payload:
+        return config.get('negative_cache_ttl', 7 * 24 * 3600)
+    return None
+
+
+# Memory -> local disk -> geocode_cache collection shared by the hosts.
+# With cache_compact, the memory tier is a PointStore instead of the LRU
+# dictionary of the Cache
+openmaps_tiers = [('disk', disk_cache)]
+if config.get('cache_compact', False):
+    openmaps_tiers.insert(0, ('memory', PointStore()))
+if config.get('shared_cache', False):
+    openmaps_tiers.append(('shared', MongoCache(
+        'geocode_cache', config.get('shared_cache_ttl'),
+        config.get('shared_cache_cooldown', 60))))
+openmaps_store = disk_cache
+if len(openmaps_tiers) > 1:
+    openmaps_store = TieredStore(openmaps_tiers, ttl_for=negative_ttl)
+    metrics.register_cache('openmaps_store', openmaps_store)
+
+
+def compute_checksum(directory, files_manifest=None):
+    """ Returns the checksum of the directory computed from its manifest
+    (name, size, modification time and inode of each file)
 
     Args:
         directory: full path of the directory
+        files_manifest: manifest of the directory, if already scanned
     Returns:
         directory checksum
     """
     log.debug("Calculating checksum for {} directory...".format(directory))
-    ls_files = subprocess.run(['ls', '-tr', directory], capture_output=True)
-    return hashlib.md5(ls_files.stdout).hexdigest()
+    if files_manifest is None:
+        files_manifest = manifest.scan(directory)
+    return manifest.checksum(files_manifest)
 
 
-def get_metadata(directory):
-    """ Get pictures metadata in using exiftool.
-        The extraction is done per directory
+@metrics.timed('metadata')
+def get_metadata(directory, files=None):
+    """ Get pictures metadata. JPEG and TIFF files are read directly
+        (if native_exif is enabled), the other files using the exiftool pool.
+        Only the GPS tags (and the date the picture was taken) are extracted
 
         Args:
             directory: full path of the directory
+            files: names of the files to read. Default: all the files
         Returns:
-            dictionary having the files as keys and files metadata as values.
+            list of dictionaries having the tags as keys (and 'SourceFile')
+            one per file
     """
-    files_list = glob.iglob(directory + '/*')
-    with exiftool.ExifTool() as et:
-        log.debug("Getting picture metadata from files...")
+    if files is None:
+        files_list = sorted(
+            f for f in glob.iglob(directory + '/*') if os.path.isfile(f))
+    else:
+        files_list = [os.path.join(directory, f) for f in files]
+    log.debug("Getting picture metadata from files...")
+    metadata = {}
+    if config.get('native_exif', True):
+        for f in files_list:
+            tags = exif.read_gps(f)
+            if tags is not None:
+                metadata[f] = tags
+    exiftool_files = [f for f in files_list if f not in metadata]
+    if exiftool_files:
         try:
-            return et.get_metadata_batch(files_list)
-        except OSError as e:
+            for tags in exif.get_exiftool_pool(config).get_tags(
+              exif.GPS_TAGS, exiftool_files):
+                metadata[tags['SourceFile']] = tags
+        except (OSError, ValueError) as e:
             log.error(str(e))
+    return [metadata[f] for f in files_list if f in metadata]
+
+
+@Cache(maxsize=0 if config.get('cache_compact', False) else
+       config.get('cache_maxsize', 1024),
+       maxbytes=config.get('cache_maxbytes'),
+       ttl=config.get('cache_ttl'), store=openmaps_store,
+       ttl_for=negative_ttl)
+@metrics.timed('openmaps', directory_arg=False)
+def openmaps_response(latitude, longitude, zoom=None):
+    """ Returns the parsed OpenMaps API response for the coordinates (at
+        the given zoom, if any), {'error': ...} if there is no result
+        (cached as a negative answer) or None if the request failed
+        (not cached)
+    """
+    # Only the requests actually made, not the cache hits
+    metrics.inc('lookups_total', zoom='coarse' if zoom else 'fine')
+    response = geocoder.get_openmaps_client(config).get(
+        latitude, longitude, zoom)
+    if response is None:
+        return None
+    try:
+        payload = response.json()
+    except ValueError:
+        log.error("Invalid OpenMaps response for {},{}".format(
+            latitude, longitude))
+        return None
+    if not response.ok and 'error' not in payload:
+        return None
+    if 'error' in payload:
+        metrics.inc('openmaps_no_result_total')
+    return payload
 
 
-@Cache(cache=cache.load(), maxsize=1024)
-def openmaps_response(latitude, longitude):
-    with open('config.yaml', 'r') as fh:
-        config = yaml.load(fh)
-    url = config['openmaps_base_url']
-    params = {'lat': latitude, 'lon': longitude}
-    # Create a fake User Agent for the requests
-    headers = {'User-Agent': UserAgent().firefox}
+metrics.register_cache('openmaps', openmaps_response.cache)
 
-    try:
-        response = requests.get(url=url, params=params, headers=headers)
-        if response.ok:
-            return response
-    except requests.exceptions.ConnectionError as e:
-        return None
 
+def lookup_plan(clusters):
+    """ Returns the arguments of reverse_geocode for each cluster. With
+        coarse_zoom set, only the clusters which can name a place in the
+        folder name are looked up at the default (finest) zoom:
+            - the clusters having PLACE_MIN_COUNT pictures or more
+            - the small clusters of a place (cell of place_radius metres)
+              having enough pictures altogether. They share the lookup of
+              the largest one
+        The other clusters only count in their Area: they are looked up at
+        coarse_zoom (ex. 10: city) at the centre of their cell of
+        coarse_radius metres, the same lookup for all the clusters of the
+        cell, in all the folders
 
-def geotag_dir(directory, skip_db=False, openmaps_cache={}):
-    """ Computes 'locations' dictionary of the folder
+        Args:
+            clusters: list of ((latitude, longitude), weight)
+        Returns:
+            list of tuples (latitude, longitude[, zoom]), one per cluster
+    """
+    lookups = [tuple(point) for point, weight in clusters]
+    coarse_zoom = config.get('coarse_zoom')
+    if not coarse_zoom:
+        return lookups
+    weights = [weight for point, weight in clusters]
+    places = [cluster.snap(*point, config.get('place_radius', 100))
+              if weight < folders.PLACE_MIN_COUNT else None
+              for point, weight in clusters]
+    fine = set(cluster.heavy_groups(places, weights, folders.PLACE_MIN_COUNT))
+    largest = {}
+    for index in sorted(fine, key=lambda index: -weights[index]):
+        largest.setdefault(places[index], lookups[index])
+    coarse_radius = config.get('coarse_radius', 1000)
+    for index, (point, weight) in enumerate(clusters):
+        if index in fine:
+            lookups[index] = largest[places[index]]
+        elif places[index] is not None:
+            lookups[index] = cluster.centre(*point, coarse_radius) + (
+                coarse_zoom,)
+    return lookups
+
+
+def reverse_geocode(latitude, longitude, zoom=None):
+    """ Resolves the coordinates to an OpenMaps-like payload. If the local
+        geocoder is configured, it is tried first. The OpenMaps API is called
+        if the local geocoder is disabled or, when geocoder_fallback is set,
+        if it has no place close enough, unless a point within nearby_radius
+        metres was already resolved.
+        A coarse answer (zoom) keeps only the area, without the name of
+        the place.
+
+        Args:
+            latitude, longitude: coordinates of the picture
+            zoom: detail level of the answer. Default: the finest
+        Returns:
+            tuple: (OpenMaps-like payload, OpenMaps URL or None
+                if resolved locally or by a nearby point)
+    """
+    local_geocoder = geocoder.get_local_geocoder(config)
+    if local_geocoder is not None:
+        payload = local_geocoder.reverse(latitude, longitude)
+        if payload is not None or not config.get('geocoder_fallback', True):
+            return payload, None
+    # Answer of a point resolved a few metres away
+    nearby_index = geocoder.get_nearby_index(config, disk_cache)
+    if nearby_index is not None:
+        payload = nearby_index.reverse(latitude, longitude)
+        if payload is not None:
+            if zoom:
+                payload = dict(payload, name=None)
+            return payload, None
+    client = geocoder.get_openmaps_client(config)
+    if zoom:
+        payload = openmaps_response(latitude, longitude, zoom)
+        if payload is not None and 'error' not in payload:
+            payload = dict(payload, name=None)
+        return payload, client.url(latitude, longitude, zoom)
+    payload = openmaps_response(latitude, longitude)
+    if nearby_index is not None:
+        nearby_index.add_payload(latitude, longitude, payload)
+    return payload, client.url(latitude, longitude)
+
+
+def directory_names(directory):
+    """ Returns the names of the directory
 
         Args:
             directory: absolute path of the photos directory
-            force: force check. Default: False
         Returns:
-            locations dictionary
-        Ex:
-        {
-            "Country": "Romania"
-            "Areas": {
-                "Bucharest": ["Piata Unirii", "Piata Romana"] },
-                "Roman": ["Primarie"]
-                }
-        }
+            tuple: (original name - path ending in yyyy_mm_dd,
+                date - yyyy_mm_dd, basename of the directory)
     """
-    # Get basename for the directory name and
-    # get the basename of its original name (yyyy_mm_dd)
     directory_orig_name = re.sub(r'(\d{4}_\d{2}_\d{2}).*', '\\1', directory)
     directory_date = os.path.basename(directory_orig_name)
     directory_base = os.path.basename(directory)
+    return directory_orig_name, directory_date, directory_base
 
-    # Check if directory has already an entry in DB. This can be skipped and
-    # check can be forced by adding "force" as the second argument
-    # Get checksum of the directory. Needed whether the check is forced or not,
-    # because needs to be either checked or stored in the DB
-    directory_checksum = compute_checksum(directory)
-    if not skip_db:
-        locations = load_from_db(directory, directory_checksum)
-        if locations is not None:
-            return (directory_orig_name, locations, openmaps_cache)
-    # If not in DB, continue
+
+def gps_points(exiftools_metadata):
+    """ Returns the (latitude, longitude) of the pictures having GPS tags
+    """
+    points = []
+    for picture in exiftools_metadata or []:
+        try:
+            points.append((picture['Composite:GPSLatitude'],
+                           picture['Composite:GPSLongitude']))
+        except KeyError as e:
+            pass
+    return points
+
+
+@metrics.timed('geocoding')
+def locate(directory, exiftools_metadata):
+    """ Computes 'locations' dictionary from the pictures metadata
+
+        Args:
+            directory: absolute path of the photos directory
+            exiftools_metadata: pictures metadata returned by get_metadata
+        Returns:
+            tuple: (locations dictionary or None if no picture could be
+                located, list of the called OpenMaps URLs)
+    """
     # Areas dict should be a defaultdict with the default element as Counter
     # (to count the appereance of each Name)
     locations = {}
@@ -126,130 +280,332 @@ def geotag_dir(directory, skip_db=False, openmaps_cache={}):
     # Create a set to store all the URLs
     openmaps_urls = set()
 
-    # Get the pictures metadata
-    exiftools_metadata = get_metadata(directory)
-
-    # Loop through pictures and get their location
+    # Group the pictures taken at the same place, so that only one
+    # location per cluster is retrieved
+    metrics.inc('pictures_total', len(exiftools_metadata or []))
+    points = gps_points(exiftools_metadata)
+    metrics.inc('pictures_gps_total', len(points))
+    radius = config.get('cluster_radius', 0)
+    clusters = cluster.cluster_points(points, radius)
+    metrics.inc('clusters_total', len(clusters))
+    # Cluster -> (Area, Place), to tag each picture with its place
+    cluster_places = {}
+    log.debug("{} pictures with GPS grouped in {} clusters".format(
+        len(points), len(clusters)))
+
+    # Get the location of all the clusters at once and loop through them
     log.info(
         f"Call OpenMaps API to retrieve location information for {directory}")
-    for picture in exiftools_metadata:
+    lookups = lookup_plan(clusters)
+    # One request for the clusters sharing a lookup
+    unique = list(dict.fromkeys(lookups))
+    futures = dict(zip(unique, geocoder.get_openmaps_client(config).map(
+        reverse_geocode, unique)))
+    metrics.inc('lookups_shared_total', len(lookups) - len(unique))
+    for ((latitude, longitude), weight), lookup in zip(clusters, lookups):
         try:
-            latitude = picture['Composite:GPSLatitude']
-            longitude = picture['Composite:GPSLongitude']
-            response = openmaps_response(latitude, longitude)
-            openmaps_cache.update({(latitude, longitude): response})
+            payload, url = futures[lookup].result()
+            if payload is None:
+                continue
+            if url is not None:
+                openmaps_urls.add(url)
 
-            location = geolocation.compute(response.json())
-            openmaps_urls.add(response.url)
+            location = geolocation.compute(payload)
+            # No result for the position ({'error': ...})
+            if location is None:
+                continue
 
             # Add Country to the locations dict
             if 'Country' not in locations:
                 locations['Country'] = location['Country']
-            # Add Area to locations dict
-            if not locations['Areas']:
-                locations['Areas'][location['Area']]
+            # Add Area to locations dict, also for the answers without
+            # Place (coarse and nearby admin answers name only the Area)
+            locations['Areas'][location['Area']]
             # Add Areas and Places to locations. To each place key,
             # add each "Place" which belongs to and its occurence
-            if location['Place']:
+            # (the number of pictures in the cluster)
+            if location.get('Place'):
                 locations['Areas'][location['Area']].update(
-                    [location['Place']])
+                    {location['Place']: weight})
+            cluster_places[cluster.snap(latitude, longitude, radius)] = (
+                location['Area'], location.get('Place'))
 
         except HTTPError as e:
             log.error(str(e))
         except KeyError as e:
             pass
 
+    for picture in exiftools_metadata or []:
+        try:
+            picture['Geotag:Area'], picture['Geotag:Place'] = \
+                cluster_places[cluster.snap(
+                    picture['Composite:GPSLatitude'],
+                    picture['Composite:GPSLongitude'], radius)]
+        except KeyError as e:
+            pass
+
     # If country not in locations for all the files, we assume
     # there was no valid response -> locations = None
     if 'Country' not in locations:
         locations = None
     # To be able to serialize/insert to URLs DB, convert the set to list
-    openmaps_urls = list(openmaps_urls)
+    return locations, list(openmaps_urls)
+
+
+def merge_locations(locations, new_locations):
+    """ Adds the places count of new_locations to locations
+
+        Args:
+            locations: locations dictionary (ex. loaded from the DB) or None
+            new_locations: locations dictionary or None
+        Returns:
+            merged locations dictionary
+    """
+    if locations is None or new_locations is None:
+        return new_locations or locations
+    merged = {'Country': locations.get('Country'),
+              'Areas': defaultdict(Counter)}
+    for source in (locations, new_locations):
+        for area, places in source['Areas'].items():
+            merged['Areas'][area].update(places or {})
+    if merged['Country'] is None:
+        merged['Country'] = new_locations.get('Country')
+    return merged
+
+
+@metrics.timed('scan')
+def scan_dir(directory, skip_db=False, records=None):
+    """ Scans the directory and compares it with its DB record, to find
+        which files have to be read
+
+        Args:
+            directory: absolute path of the photos directory
+            skip_db: don't check the DB. Default: False
+            records: checksums of the directories loaded at once with
+                mongo.load_directories. If given, the full DB record is
+                loaded only for the directories which changed
+        Returns:
+            dictionary:
+                manifest, checksum: of the directory
+                cached: True if the DB record is up to date
+                files: names of the files to read (all of them, only the
+                    ones added since the DB record, or none if cached)
+                locations, openmaps_urls: from the DB record, to be
+                    completed with the read files
+    """
+    files_manifest = manifest.scan(directory)
+    state = {
+        'manifest': files_manifest,
+        'checksum': compute_checksum(directory, files_manifest),
+        'cached': False,
+        'files': sorted(files_manifest),
+        'locations': None,
+        'openmaps_urls': []
+        }
+    if skip_db:
+        return state
+    if records is not None:
+        db_dir_metadata = records.get(os.path.basename(directory))
+    else:
+        db_dir_metadata = load_record_from_db(directory)
+    if not db_dir_metadata:
+        return state
+    if db_dir_metadata.get('directory_checksum') == state['checksum']:
+        log.info("Loading data from DB...")
+        state.update(cached=True, files=[],
+                     locations=db_dir_metadata.get('locations'))
+        return state
+    if records is not None:
+        db_dir_metadata = load_record_from_db(directory) or {}
+    # Only files were added: read just them and add their locations
+    # to the ones from the DB
+    added = manifest.added_files(
+        db_dir_metadata.get('manifest'), files_manifest)
+    if added is not None and db_dir_metadata.get('locations'):
+        log.info("{} new files in {}".format(len(added), directory))
+        state.update(
+            files=added,
+            locations=db_dir_metadata['locations'],
+            openmaps_urls=db_dir_metadata.get('openmaps_urls') or [])
+    return state
+
+
+def update_locations(directory, state, exiftools_metadata):
+    """ Locates the read files and merges them with the DB record
+
+        Args:
+            directory: absolute path of the photos directory
+            state: dictionary returned by scan_dir
+            exiftools_metadata: metadata of the read files
+        Returns:
+            tuple: (locations, metadata of the read files,
+                openmaps URLs of all the files)
+    """
+    locations, openmaps_urls = locate(directory, exiftools_metadata)
+    return (merge_locations(state['locations'], locations),
+            exiftools_metadata or [],
+            sorted(set(state['openmaps_urls']) | set(openmaps_urls)))
+
+
+def geotag_dir(directory, skip_db=False):
+    """ Computes 'locations' dictionary of the folder
+
+        Args:
+            directory: absolute path of the photos directory
+            force: force check. Default: False
+        Returns:
+            locations dictionary
+        Ex:
+        {
+            "Country": "Romania"
+            "Areas": {
+                "Bucharest": ["Piata Unirii", "Piata Romana"] },
+                "Roman": ["Primarie"]
+                }
+        }
+    """
+    # Get basename for the directory name and
+    # get the basename of its original name (yyyy_mm_dd)
+    directory_orig_name, directory_date, directory_base = directory_names(
+        directory)
+
+    # Check if directory has already an entry in DB. This can be skipped and
+    # check can be forced by adding "force" as the second argument
+    # Get the manifest of the directory. Needed whether the check is forced
+    # or not, because needs to be either checked or stored in the DB
+    state = scan_dir(directory, skip_db)
+    if state['cached']:
+        return (directory_orig_name, state['locations'])
+    # If not in DB (or files were added), continue
+    # Get the pictures metadata
+    exiftools_metadata = get_metadata(directory, state['files'])
+    locations, exiftools_metadata, openmaps_urls = update_locations(
+        directory, state, exiftools_metadata)
 
     if not skip_db:
-        store_to_db(directory_date, directory_base, directory_checksum,
-                    exiftools_metadata, openmaps_urls, locations)
+        store_to_db(directory_date, directory_base, state['checksum'],
+                    exiftools_metadata, openmaps_urls, locations,
+                    state['manifest'])
 
     # Return a tuple containing original directory name
     # and the computed location
-    return directory_orig_name, locations, openmaps_cache
+    return directory_orig_name, locations
     # log.debug (json.dumps(locations,indent=1))
 
 
-def load_from_db(directory, directory_checksum):
-    """ Checks if the directory location information is already stored in the DB.
-        Checksum is also computed and compares with the one stored in the DB, 
-        in case there are changes in the directory
-
-        Args:
-            directory: absolute path of the photo directory
-            directory_checksum: computed checksum of the directory
-        Returns:
-            database content corresponding to 'locations' key of the directory
-            None - if not present
+@metrics.timed('db')
+def load_record_from_db(directory):
+    """ Returns the DB record of the directory or None if not present
     """
     try:
         with MongoConnector() as mongo:
             directory_base = os.path.basename(directory)
             # Check if and entry with the directory name is present in DB
-            db_dir_metadata = mongo.find_one(
-                {'directory': directory_base}) or None
-            # Check if directory has an entry in the db and if so
-            # if the checksum from db is the same as the computed one
-            if db_dir_metadata and directory_checksum == db_dir_metadata[
-              'directory_checksum']:
-                log.info("Loading data from DB...")
-                # log.debug (json.dumps(db_dir_metadata['locations'],indent=1))
-                return db_dir_metadata['locations']
-    except KeyError as e:
-        log.warning("Check DB structure! Key {} is missing. \
-            Re-computing result!".format(e))
+            return mongo.find_one(
+                {'directory': directory_base},
+                {'_id': 0, 'exiftools_metadata': 0}) or None
     except Exception as e:
         log.error(e)
 
 
+def picture_record(directory_base, picture, compression=None):
+    """ Returns the document of the 'pictures' collection for a picture:
+        just the fields we use and, if compression is set ('zlib' or
+        'zstd'), all the tags compressed as JSON
+    """
+    record = {
+        'directory': directory_base,
+        'file': os.path.basename(picture['SourceFile']),
+        'lat': picture.get('Composite:GPSLatitude'),
+        'lon': picture.get('Composite:GPSLongitude'),
+        'timestamp': picture.get('EXIF:DateTimeOriginal'),
+        'area': picture.get('Geotag:Area'),
+        'place': picture.get('Geotag:Place')
+        }
+    if compression:
+        tags = json.dumps(picture).encode('utf-8')
+        if compression == 'zstd' and zstandard is not None:
+            record['tags'] = Binary(zstandard.ZstdCompressor().compress(tags))
+        else:
+            compression = 'zlib'
+            record['tags'] = Binary(zlib.compress(tags))
+        record['tags_compression'] = compression
+    return record
+
+
+def db_requests(
+  directory_date, directory_base, directory_checksum,
+  exiftools_metadata, openmaps_urls, locations, files_manifest=None):
+    """ Returns the write requests storing the directory: its record in
+        the 'metadata' collection and one document per picture in the
+        'pictures' collection (see store_to_db for the arguments)
+
+        Returns:
+            list of (collection name, pymongo write operation)
+    """
+    files_manifest = files_manifest or {}
+    db_entry = {
+            "date": directory_date,
+            "directory": directory_base,
+            "directory_checksum": directory_checksum,
+            "openmaps_urls": openmaps_urls,
+            "locations": locations,
+            "manifest": manifest.to_list(files_manifest),
+            "files_count": len(files_manifest)
+            }
+    compression = config.get('pictures_tags_compression')
+    requests = [('metadata', UpdateOne(
+        {"date": directory_date},
+        # Documents of the previous schema kept all the metadata
+        {"$set": db_entry, "$unset": {"exiftools_metadata": ""}},
+        upsert=True))]
+    for picture in exiftools_metadata or []:
+        record = picture_record(directory_base, picture, compression)
+        requests.append(('pictures', ReplaceOne(
+            {'directory': directory_base, 'file': record['file']},
+            record, upsert=True)))
+    # Pictures removed from the directory
+    requests.append(('pictures', DeleteMany(
+        {'directory': directory_base,
+         'file': {'$nin': sorted(files_manifest)}})))
+    return requests
+
+
+@metrics.timed('db', directory_arg=False)
 def store_to_db(
   directory_date, directory_base, directory_checksum,
-  exiftools_metadata, openmaps_urls, locations):
-    """ Stores date, directory name, directory checksum, exiftool metadata,
-        openmaps URLs and locations dictionary in the databaase
+  exiftools_metadata, openmaps_urls, locations, files_manifest=None):
+    """ Stores date, directory name, directory checksum, openmaps URLs,
+        locations dictionary and the manifest of the files in the databaase
+        ('metadata' collection) and the pictures metadata in the 'pictures'
+        collection (one document per picture)
 
         Args:
             directory_date: directory original name containing just the date
                 in format yyyy_mm_dd
             directory_base: basename of the photo directory
             directory_checksum: computed checksum of the directory
-            exiftools_metadata: photos metadata
+            exiftools_metadata: metadata of the pictures read in this run
+                (the other pictures of the directory are kept)
             openmaps_urls: list containing all the called openmaps URLs
                 for this directory
             locations: dictionary containing the locations
+            files_manifest: manifest of the directory (see manifest.scan)
         Returns:
             True - if successfull; None - if exception occurs
     """
+    requests = db_requests(
+        directory_date, directory_base, directory_checksum,
+        exiftools_metadata, openmaps_urls, locations, files_manifest)
     try:
-        with MongoConnector() as mongo:
-            db_entry = {
-                    "date": directory_date,
-                    "directory": directory_base,
-                    "directory_checksum": directory_checksum,
-                    "exiftools_metadata": exiftools_metadata,
-                    "openmaps_urls": openmaps_urls,
-                    "locations": locations
-                    }
-            if mongo.find_one({"date": directory_date}):
-                mongo.update({"date": directory_date}, {"$set": db_entry})
-            else:
-                mongo.insert(db_entry)
-            return True
-    except pymongo_errors.DuplicateKeyError as py_e:
+        mongo_write(requests)
+        return True
+    except pymongo_errors.PyMongoError as py_e:
         log.info("Cannot insert {} in the DB: {}".format(
-            db_entry, str(py_e)))
+            directory_base, str(py_e)))
 
 
 def main():
-    with open('config.yaml', 'r') as fh:
-        config = yaml.load(fh)
-
     # Add arguments for program
     # --force : geotag check to be peformed no matter if entry is stored in DB
     # --directory PHOTO_DIR: directory to be checked. If not provided, 
@@ -0,0 +1,98 @@
+import queue
+import threading
+import logger
+
+log = logger.generate_logger()
+
+"""
+Multi-stage pipeline: items produced by a source go through a list of
+stages. Each stage has its own worker threads and the stages are joined
+by bounded queues, so a slow stage blocks the ones before it instead of
+buffering everything in memory, and all the stages run at the same time.
+A stage function takes an item and returns the item for the next stage,
+or None to drop it. The items for which it raises are logged and passed
+to the on_error function of the stage, if any.
+"""
+
+_DONE = object()
+
+
+class Stage(object):
+    """Description:
+            One step of the pipeline, run by 'workers' threads
+
+       Usage:
+            Stage('metadata', function, workers=2, on_error=None)
+    """
+    def __init__(self, name, function, workers=1, on_error=None):
+        self.name = name
+        self._function = function
+        self._workers = workers
+        self._on_error = on_error
+        self._threads = []
+
+    def start(self, inbox, outbox):
+        for i in range(self._workers):
+            thread = threading.Thread(
+                target=self._run, args=(inbox, outbox),
+                name='{}-{}'.format(self.name, i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self, inbox, outbox):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # Let the other workers of the stage stop as well
+                inbox.put(_DONE)
+                return
+            try:
+                result = self._function(item)
+            except Exception:
+                log.exception("Stage {} failed for {}".format(
+                    self.name, item))
+                if self._on_error is not None:
+                    try:
+                        self._on_error(item)
+                    except Exception:
+                        log.exception("on_error of stage {} failed".format(
+                            self.name))
+                continue
+            if result is not None and outbox is not None:
+                outbox.put(result)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+class Pipeline(object):
+    """Description:
+            Runs the items of the source through the stages.
+            The last stage results are discarded.
+
+       Usage:
+            pipeline = Pipeline([Stage('a', f, 2), Stage('b', g)])
+            pipeline.run(items)
+    """
+    def __init__(self, stages, queue_size=16):
+        self._stages = stages
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+
+    def run(self, source):
+        for i, stage in enumerate(self._stages):
+            outbox = self._queues[i + 1] if i + 1 < len(
+                self._stages) else None
+            stage.start(self._queues[i], outbox)
+        count = 0
+        try:
+            for item in source:
+                self._queues[0].put(item)
+                count += 1
+        finally:
+            # Stop the stages in order, once the previous one is done,
+            # even if the source failed
+            for i, stage in enumerate(self._stages):
+                self._queues[i].put(_DONE)
+                stage.join()
+        return count
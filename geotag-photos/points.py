@@ -0,0 +1,190 @@
+import bisect
+import threading
+from array import array
+import cluster
+
+"""
+Compact in-memory representation of the resolved points, to keep the
+answers of millions of lookups in memory:
+    - the coordinates are quantized to their Morton code (an int64, ~5cm)
+      held in a sorted array('q')
+    - the answers are Location records (with __slots__) keeping only the
+      fields geolocation.compute uses. They are interned: all the points of
+      the same place share one record, referenced by its index in an
+      array('I')
+About 12 bytes per point, plus the distinct places.
+Usage:
+    store = PointStore()
+    store.set((44.4268, 26.1025), payload)
+    store.get((44.4268, 26.1025))
+"""
+
+# OpenMaps address keys used by geolocation.compute
+ADDRESS_KEYS = ('city', 'town', 'village', 'neighbourhood', 'county',
+                'state_district', 'state', 'country')
+# Bits per coordinate of the codes: 2 * 29 bits fit in an int64
+MORTON_BITS = 29
+
+
+def point_code(latitude, longitude):
+    return cluster.morton(float(latitude), float(longitude), MORTON_BITS)
+
+
+class Location(object):
+    """Description:
+            Name and address of a place, as answered by the OpenMaps API
+            (only the keys in ADDRESS_KEYS). Immutable once interned.
+
+       Usage:
+            location = Location.from_payload(payload)
+            location.payload()
+    """
+    __slots__ = ('name',) + ADDRESS_KEYS
+
+    def __init__(self, name=None, **address):
+        self.name = name
+        for key in ADDRESS_KEYS:
+            setattr(self, key, address.get(key) or None)
+
+    @staticmethod
+    def payload_key(payload):
+        """ Returns the values of the slots for the payload
+        """
+        address = payload.get('address') or {}
+        return (payload.get('name') or None,) + tuple(
+            address.get(key) or None for key in ADDRESS_KEYS)
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload.get('name'), **(payload.get('address') or {}))
+
+    def key(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def address(self, keys=ADDRESS_KEYS):
+        return {key: getattr(self, key) for key in keys
+                if getattr(self, key) is not None}
+
+    def payload(self):
+        """ Returns the OpenMaps-like payload of the place
+        """
+        return {'name': self.name, 'address': self.address()}
+
+
+class LocationTable(object):
+    """Description:
+            Interned Location records, identified by their index.
+            Thread safe.
+
+       Usage:
+            location_id = locations.intern(payload)
+            locations[location_id].payload()
+    """
+    def __init__(self):
+        self._records = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, location_id):
+        return self._records[location_id]
+
+    def intern(self, payload):
+        key = Location.payload_key(payload)
+        with self._lock:
+            location_id = self._ids.get(key)
+            if location_id is None:
+                location_id = self._ids[key] = len(self._records)
+                self._records.append(Location.from_payload(payload))
+        return location_id
+
+
+# Shared by all the stores and indexes of the process
+locations = LocationTable()
+
+
+class PointStore(object):
+    """Description:
+            In-memory store of the answers of the (latitude, longitude)
+            lookups, to be used as the first tier of a cache.TieredStore.
+            Other arguments (ex. with a zoom), answers without result and
+            entries having a TTL are not kept (they stay in the other
+            tiers). New points are added to a dictionary, merged in the
+            sorted arrays once it holds 'merge_size' points or a quarter
+            of the arrays.
+
+       Usage:
+            store = PointStore()
+            store.set((44.4268, 26.1025), payload)
+            store.get((44.4268, 26.1025))
+    """
+    def __init__(self, merge_size=4096, table=locations):
+        self._codes = array('q')
+        self._ids = array('I')
+        self._pending = {}
+        self._merge_size = merge_size
+        self._table = table
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._codes) + len(self._pending)
+
+    def _find(self, code):
+        location_id = self._pending.get(code)
+        if location_id is None:
+            index = bisect.bisect_left(self._codes, code)
+            if index < len(self._codes) and self._codes[index] == code:
+                location_id = self._ids[index]
+        return location_id
+
+    def get(self, args):
+        if len(args) != 2:
+            return None
+        code = point_code(*args)
+        with self._lock:
+            location_id = self._find(code)
+        if location_id is None:
+            return None
+        return self._table[location_id].payload()
+
+    def set(self, args, value, ttl=None):
+        if len(args) != 2 or ttl or not value or 'error' in value:
+            return
+        code = point_code(*args)
+        location_id = self._table.intern(value)
+        with self._lock:
+            index = bisect.bisect_left(self._codes, code)
+            if index < len(self._codes) and self._codes[index] == code:
+                self._ids[index] = location_id
+                return
+            self._pending[code] = location_id
+            if len(self._pending) >= max(self._merge_size,
+                                         len(self._codes) // 4):
+                self._merge()
+
+    def _merge(self):
+        # Slices of the sorted arrays are copied between the pending
+        # points, without creating an object per point
+        codes, ids = array('q'), array('I')
+        start = 0
+        for code, location_id in sorted(self._pending.items()):
+            index = bisect.bisect_left(self._codes, code, start)
+            codes.extend(self._codes[start:index])
+            ids.extend(self._ids[start:index])
+            codes.append(code)
+            ids.append(location_id)
+            start = index
+        codes.extend(self._codes[start:])
+        ids.extend(self._ids[start:])
+        self._codes, self._ids = codes, ids
+        self._pending = {}
+
+    def nbytes(self):
+        """ Returns the size of the arrays in bytes
+        """
+        with self._lock:
+            return (self._codes.itemsize * len(self._codes) +
+                    self._ids.itemsize * len(self._ids))
@@ -0,0 +1,109 @@
+from collections import defaultdict, Counter
+import cluster
+import geocoder
+import metrics
+import photos
+from pipeline import Pipeline, Stage
+from config import log, config
+
+"""
+Prefetch of the geocoding of the whole library, before the folders are
+geotagged (main.py --prefetch):
+    - the points which locate() will look up are gathered from every
+      folder: the representatives of the clusters of each folder (only the
+      folders to update and only their files to read)
+    - they are grouped in cells of cluster_radius metres over the whole
+      library, so that a place photographed in hundreds of folders is a
+      single cell
+    - one point per cell is resolved, in Z-order (close cells one after the
+      other), and its answer is cached for all the points of the cell.
+      With coarse_zoom, the small clusters have the lookups of lookup_plan:
+      the ones of a coarse cell are a single point
+Afterwards geotag_dir only reads the cache and the number of OpenMaps calls
+is the number of distinct places of the library.
+Usage:
+    prefetch.run(main.get_folders(), skip_db=True)
+"""
+
+
+def gather(folders_to_check, skip_db=True, records=None):
+    """ Reads the GPS points of the folders
+
+        Args:
+            folders_to_check: iterable of absolute paths of the folders
+            skip_db: don't check the DB (all the folders are read)
+            records: DB records of the folders, see mongo.load_directories
+        Returns:
+            dictionary: cell (and zoom) -> Counter of the arguments of
+                reverse_geocode of the cell (and their number of pictures)
+    """
+    radius = config.get('cluster_radius', 0)
+    cells = defaultdict(Counter)
+
+    def extract(folder):
+        job = photos.scan_dir(folder, skip_db, records)
+        if job['cached'] or not job['files']:
+            return None
+        points = photos.gps_points(photos.get_metadata(folder, job['files']))
+        return cluster.cluster_points(points, radius)
+
+    def collect(clusters):
+        for args, (point, weight) in zip(photos.lookup_plan(clusters),
+                                         clusters):
+            cells[cluster.snap(*args[:2], radius) + args[2:]][args] += weight
+
+    Pipeline([
+        Stage('prefetch', extract, config.get('metadata_workers', 2)),
+        Stage('collect', collect)
+        ], queue_size=config.get('pipeline_queue_size', 16)).run(
+        folders_to_check)
+    return cells
+
+
+def resolve(cells):
+    """ Resolves one point per cell (the most photographed one), in Z-order,
+        and caches its answer for the other points of the cell. The cells
+        having all their points cached are skipped
+
+        Returns:
+            number of resolved cells
+    """
+    cache = photos.openmaps_response.cache
+    pending = []
+    for members in cells.values():
+        missing = [args for args in members if args not in cache]
+        if missing:
+            pending.append((members.most_common(1)[0][0], missing))
+    pending.sort(key=lambda cell: cluster.morton(*cell[0][:2]))
+    futures = geocoder.get_openmaps_client(config).map(
+        photos.reverse_geocode, [args for args, missing in pending])
+    for (args, missing), future in zip(pending, futures):
+        try:
+            payload, url = future.result()
+        except Exception as e:
+            log.error("Prefetch of {} failed: {}".format(args, e))
+            continue
+        # Failed, or resolved by the local geocoder (not cached)
+        if payload is None or url is None:
+            continue
+        for other in missing:
+            if other != args:
+                cache.set(other, payload)
+    return len(pending)
+
+
+@metrics.timed('prefetch', directory_arg=False)
+def run(folders_to_check, skip_db=True, records=None):
+    """ Gathers the points of all the folders and resolves them
+
+        Returns:
+            tuple: (number of points, number of resolved cells)
+    """
+    cells = gather(folders_to_check, skip_db, records)
+    points = sum(len(members) for members in cells.values())
+    resolved = resolve(cells)
+    metrics.inc('prefetch_points_total', points)
+    metrics.inc('prefetch_cells_total', resolved)
+    log.info("Prefetch: {} points in {} places, {} resolved".format(
+        points, len(cells), resolved))
+    return points, resolved
@@ -0,0 +1,36 @@
+import benchmark
+import exif
+import json
+import os
+import pytest
+import urllib.request
+
+
+def test_generate_tree(tmp_path):
+    folders = benchmark.generate_tree(
+        str(tmp_path), folders=3, pictures=20, start_year=2018,
+        distributions=('cluster', 'roadtrip', 'nogps'), no_gps=0)
+    assert len(folders) == 3
+    assert all(os.path.basename(os.path.dirname(folder)) == '2018'
+               for folder in folders)
+    with_gps = [len([tags for tags in (
+        exif.read_gps(os.path.join(folder, f)) for f in os.listdir(folder))
+        if 'Composite:GPSLatitude' in tags]) for folder in folders]
+    assert with_gps == [20, 20, 0]
+
+
+def test_jpeg_gps():
+    tiff = benchmark.tiff_gps(-4.3274, 55.7335, '2018:09:10 10:00:00')
+    assert exif._parse_tiff(tiff) == {
+        'Composite:GPSLatitude': pytest.approx(-4.3274),
+        'Composite:GPSLongitude': pytest.approx(55.7335),
+        'EXIF:DateTimeOriginal': '2018:09:10 10:00:00'}
+
+
+def test_openmaps_stub():
+    with benchmark.OpenMapsStub(latency=0) as stub:
+        with urllib.request.urlopen(stub.url + '&lat=44.42&lon=26.10') as f:
+            payload = json.load(f)
+        assert stub.requests == 1
+    assert payload == benchmark.OpenMapsStub.answer(44.42, 26.10)
+    assert payload['address']['country']
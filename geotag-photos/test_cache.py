@@ -1,40 +1,169 @@
 import cache
 import pytest
 import os
+import time
+import yaml
 
 
-def test_cache_miss():
-    cache_file = '.test1.yml'
-    cache_obj = cache.DiskCache(cache_file)
-    loaded_cache = cache_obj.load()
+def test_cache_miss(tmp_path):
+    cache_file = str(tmp_path / 'test1.db')
+    cache_obj = cache.DiskCache(cache_file).load()
 
-    @cache.Cache(cache=loaded_cache)
+    @cache.Cache(store=cache_obj)
     def func(*args):
         test = ''.join([str(i) for i in args])
         print(test)
         return test
 
     func(1, 2)
-    assert cache.Cache.load_from_cache is False
+    assert func.cache.load_from_cache is False
+    assert func.cache.misses == 1
 
 
-def test_use_cache_from_disk():
-    cache_file = '.test1.yml'
-    cache_obj = cache.DiskCache(cache_file)
-    loaded_cache = cache_obj.load()
+def test_use_cache_from_disk(tmp_path):
+    cache_file = str(tmp_path / 'test1.db')
+    cache_obj = cache.DiskCache(cache_file).load()
 
-    @cache.Cache(cache=loaded_cache)
+    @cache.Cache(store=cache_obj)
     def func(*args):
         return ''.join([str(i) for i in args])
 
     func(1, 2)
-    cache_obj.persist(loaded_cache)
+    cache_obj.close()
 
-    func(1, 2)
-    assert cache.Cache.load_from_cache is True
+    # New in-memory cache, results are loaded from disk
+    cache_obj = cache.DiskCache(cache_file).load()
+
+    @cache.Cache(store=cache_obj)
+    def func(*args):
+        return ''.join([str(i) for i in args])
+
+    assert func(1.0, '2') == '12'
+    assert func.cache.load_from_cache is True
+    assert func.cache.hits == 1
+    cache_obj.close()
+
+
+def test_migrate_yaml_cache(tmp_path):
+    yaml_file = str(tmp_path / 'cache.yml')
+    with open(yaml_file, 'w') as f:
+        yaml.dump({'indexes': [(1.5, 2.5), (3.5, 4.5)],
+                   (1.5, 2.5): {'address': {'country': 'Romania'}},
+                   (3.5, 4.5): None}, f)
+
+    cache_obj = cache.DiskCache(yaml_file).load()
+    assert os.path.exists(str(tmp_path / 'cache.db'))
+    assert len(cache_obj) == 1
+    assert cache_obj.get((1.5, 2.5)) == {'address': {'country': 'Romania'}}
+    assert (3.5, 4.5) not in cache_obj
+    cache_obj.close()
+
+
+def test_lru_eviction():
+    @cache.Cache(maxsize=2)
+    def func(*args):
+        return sum(args)
+
+    func(1)
+    func(2)
+    # Hit refreshes 1, so 2 is the least recently used
+    func(1)
+    func(3)
+    assert func.cache.evictions == 1
+    func(1)
+    assert func.cache.load_from_cache is True
+    func(2)
+    assert func.cache.load_from_cache is False
+    assert func.cache.cache_info()['entries'] == 2
+
+
+def test_maxbytes_and_ttl():
+    @cache.Cache(maxsize=100, maxbytes=30, ttl=0.05)
+    def func(arg):
+        return 'x' * arg
+
+    func(10)
+    func(11)
+    # 12 + 13 + 14 bytes (with the JSON quotes) > 30
+    func(12)
+    assert func.cache.cache_info() == {
+        'hits': 0, 'misses': 3, 'evictions': 1, 'entries': 2, 'bytes': 27}
+    func(12)
+    assert func.cache.load_from_cache is True
+    time.sleep(0.1)
+    func(12)
+    assert func.cache.load_from_cache is False
+
+
+def test_negative_entries_expire(tmp_path):
+    disk_cache = cache.DiskCache(str(tmp_path / 'cache.db'))
+    calls = []
+
+    @cache.Cache(store=disk_cache, ttl_for=lambda payload: 0.05
+                 if 'error' in payload else None)
+    def lookup(lat, lon):
+        calls.append((lat, lon))
+        return None if lat is None else (
+            {'error': 'Unable to geocode'} if lat == 0 else {'name': 'x'})
+
+    # Failures are not cached
+    assert lookup(None, 1) is None and lookup(None, 1) is None
+    assert len(calls) == 2
+    lookup(0, 0)
+    lookup(0, 0)
+    lookup(1, 1)
+    assert len(calls) == 4
+    time.sleep(0.06)
+    assert disk_cache.get((0, 0)) is None
+    assert disk_cache.get((1, 1)) == {'name': 'x'}
+    lookup(0, 0)
+    assert len(calls) == 5
+    disk_cache.close()
+
+
+def test_tiered_store(tmp_path):
+    local = cache.DiskCache(str(tmp_path / 'local.db'))
+    shared = cache.DiskCache(str(tmp_path / 'shared.db'))
+    shared.set((44.4, 26.1), {'name': 'Home'})
+    store = cache.TieredStore([('disk', local), ('shared', shared)])
+
+    @cache.Cache(store=store)
+    def lookup(lat, lon):
+        return {'name': 'Office'}
+
+    assert lookup(44.4, 26.1) == {'name': 'Home'}
+    # Written back to the local tier
+    assert local.get((44.4, 26.1)) == {'name': 'Home'}
+    assert lookup(45.7, 21.2) == {'name': 'Office'}
+    assert shared.get((45.7, 21.2)) == {'name': 'Office'}
+    assert store.cache_info() == {
+        'disk_hits': 0, 'shared_hits': 1, 'misses': 1}
+
+
+def test_shared_cache_cooldown(monkeypatch):
+    import mongo
+    from pymongo import errors
+    attempts = []
+
+    class DownConnector(object):
+        def __init__(self, collection):
+            pass
 
-    os.remove(cache_file)
+        def __enter__(self):
+            attempts.append(1)
+            raise errors.AutoReconnect('DB down')
 
+        def __exit__(self, *args):
+            pass
 
-if __name__ == "__main__":
-    test_cache_miss()
+    monkeypatch.setattr(mongo, 'check_db', lambda: True)
+    monkeypatch.setattr(mongo, 'MongoConnector', DownConnector)
+    shared = mongo.MongoCache(cooldown=60)
+    assert shared.get((44.4, 26.1)) is None
+    # Skipped during the cooldown
+    shared.set((44.4, 26.1), {'name': 'Bucharest'})
+    assert shared.get((44.4, 26.1)) is None
+    assert len(attempts) == 1
+    shared._retry_at = 0
+    assert shared.get((44.4, 26.1)) is None
+    assert len(attempts) == 2
@@ -0,0 +1,37 @@
+import cluster
+
+
+def test_exact_points():
+    points = [(1.0, 2.0), (1.0, 2.0), (1.00001, 2.0)]
+    assert cluster.cluster_points(points) == [
+        ((1.0, 2.0), 2), ((1.00001, 2.0), 1)]
+
+
+def test_cluster_radius():
+    # Burst at the beach and a single picture 1 km away
+    points = [(-4.32740, 55.73350), (-4.32741, 55.73351),
+              (-4.32741, 55.73351), (-4.33640, 55.73350)]
+    clusters = cluster.cluster_points(points, radius=25)
+    assert clusters == [((-4.32741, 55.73351), 3), ((-4.33640, 55.73350), 1)]
+    assert sum(weight for _, weight in clusters) == len(points)
+
+
+def test_morton_locality():
+    home = cluster.morton(44.4268, 26.1025)
+    assert cluster.morton(44.4268, 26.1025) == home
+    assert cluster.morton(-90, -180) == 0
+    # Close points share the high bits of their codes
+    assert home >> 20 == cluster.morton(44.4269, 26.1026) >> 20
+    assert home >> 20 != cluster.morton(-33.8688, 151.2093) >> 20
+
+
+def test_heavy_groups():
+    keys = ['Bucharest', 'Brasov', 'Bucharest', None, 'Sibiu']
+    assert cluster.heavy_groups(keys, [2, 2, 1, 5, 3], 3) == [0, 2, 4]
+
+
+def test_centre():
+    centre = cluster.centre(44.4268, 26.1025, 1000)
+    assert centre == cluster.centre(44.4269, 26.1026, 1000)
+    assert cluster.snap(*centre, 1000) == cluster.snap(44.4268, 26.1025, 1000)
+    assert centre != cluster.centre(44.4453, 26.0975, 1000)
@@ -0,0 +1,24 @@
+import discovery
+import os
+import pytest
+
+
+def test_walk(tmp_path):
+    for path in ('2017/2017_12_31', '2018/2018_01_05 Paris',
+                 '2018/2018_06_01', '2018/@eaDir', '2018/#recycle',
+                 '2019/2019_02_03', '@eaDir/2018_01_01', 'misc/2018_01_01'):
+        (tmp_path / path).mkdir(parents=True)
+    (tmp_path / '2018' / 'notes.txt').write_text('not a folder')
+    root = str(tmp_path)
+
+    def names(*args, **kwargs):
+        return [os.path.relpath(folder, root)
+                for folder in discovery.walk(root, *args, **kwargs)]
+
+    assert names() == ['2017/2017_12_31', '2018/2018_01_05 Paris',
+                       '2018/2018_06_01', '2019/2019_02_03']
+    assert names(2018, 2018) == ['2018/2018_01_05 Paris', '2018/2018_06_01']
+    assert names(start_date='2017_12_31', end_date='2018-03-01') == [
+        '2017/2017_12_31', '2018/2018_01_05 Paris']
+    with pytest.raises(ValueError):
+        discovery.walk(root, start_date='yesterday')
@@ -0,0 +1,64 @@
+import exif
+import pytest
+import struct
+from benchmark import tiff_gps
+
+
+class FakeExifTool(object):
+    def start(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def execute_json(self, *params):
+        return [{'SourceFile': param} for param in params
+                if not param.startswith('-')]
+
+
+def test_pool_batches(monkeypatch):
+    monkeypatch.setattr(exif.exiftool, 'ExifTool', FakeExifTool)
+    pool = exif.ExifToolPool(workers=2, batch_size=3)
+    files = ['{}.jpg'.format(i) for i in range(10)]
+    metadata = pool.get_tags(exif.GPS_TAGS, files)
+    # Order of the files is kept across the batches
+    assert [picture['SourceFile'] for picture in metadata] == files
+    pool.close()
+
+
+def _jpeg(tiff):
+    app1 = b'Exif\0\0' + tiff
+    return (b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 16) + bytes(14) +
+            b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 +
+            b'\xff\xda' + bytes(1000) + b'\xff\xd9')
+
+
+def test_read_gps_jpeg(tmp_path):
+    path = str(tmp_path / 'IMG_0001.jpg')
+    with open(path, 'wb') as f:
+        f.write(_jpeg(tiff_gps(-4.3274, 55.7335, '2018:09:10 10:00:00')))
+    tags = exif.read_gps(path)
+    assert tags['SourceFile'] == path
+    assert tags['EXIF:DateTimeOriginal'] == '2018:09:10 10:00:00'
+    assert tags['Composite:GPSLatitude'] == pytest.approx(-4.3274)
+    assert tags['Composite:GPSLongitude'] == pytest.approx(55.7335)
+
+
+def test_read_gps_tiff(tmp_path):
+    path = str(tmp_path / 'IMG_0001.tif')
+    with open(path, 'wb') as f:
+        f.write(tiff_gps(44.4268, -26.1025, '2018:09:10 10:00:00', '>'))
+    tags = exif.read_gps(path)
+    assert tags['Composite:GPSLatitude'] == pytest.approx(44.4268)
+    assert tags['Composite:GPSLongitude'] == pytest.approx(-26.1025)
+
+
+def test_read_gps_unsupported(tmp_path):
+    no_exif = str(tmp_path / 'no_exif.jpg')
+    with open(no_exif, 'wb') as f:
+        f.write(b'\xff\xd8\xff\xda' + bytes(100))
+    assert exif.read_gps(no_exif) == {'SourceFile': no_exif}
+    heic = str(tmp_path / 'IMG_0001.heic')
+    with open(heic, 'wb') as f:
+        f.write(b'\0\0\0\x18ftypheic' + bytes(100))
+    assert exif.read_gps(heic) is None
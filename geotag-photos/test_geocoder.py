@@ -0,0 +1,112 @@
+import geocoder
+import pytest
+import time
+
+GAZETTEER = """lat,lon,name,city,state,country
+44.4268,26.1025,Piata Unirii,Bucharest,,Romania
+44.4453,26.0975,Piata Romana,Bucharest,,Romania
+-4.3274,55.7335,Ferdinand Nature Reserve,,Praslin,Seychelles
+"""
+
+
+@pytest.fixture
+def local_geocoder(tmp_path):
+    gazetteer_file = tmp_path / 'gazetteer.csv'
+    gazetteer_file.write_text(GAZETTEER)
+    return geocoder.LocalGeocoder(str(gazetteer_file), max_distance=5).load()
+
+
+def test_reverse_nearest_place(local_geocoder):
+    assert len(local_geocoder) == 3
+    payload = local_geocoder.reverse(44.4270, 26.1030)
+    assert payload == {
+        'name': 'Piata Unirii',
+        'address': {'city': 'Bucharest', 'country': 'Romania'}}
+    assert local_geocoder.reverse(
+        '-4.3', '55.75')['address']['state'] == 'Praslin'
+
+
+def test_reverse_miss(local_geocoder):
+    assert local_geocoder.reverse(45.0, 26.1) is None
+    assert local_geocoder.reverse(0, 0) is None
+
+
+def test_reverse_across_cells(local_geocoder):
+    # Closest place is in the neighbour cell
+    payload = local_geocoder.reverse(44.4990, 26.0990)
+    assert payload is None
+    local_geocoder._max_distance = 10
+    assert local_geocoder.reverse(44.4990, 26.0990)['name'] == 'Piata Romana'
+
+
+def test_token_bucket_rate():
+    bucket = geocoder.TokenBucket(rate=20)
+    start = time.monotonic()
+    for _ in range(25):
+        bucket.acquire()
+    # 20 tokens available at start, the other 5 are refilled in 0.25s
+    assert 0.2 <= time.monotonic() - start < 1
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+
+
+def test_retry_after_backoff(monkeypatch):
+    responses = [FakeResponse(503), FakeResponse(429, {'Retry-After': '2'}),
+                 FakeResponse(200)]
+    sleeps = []
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    client = geocoder.OpenMapsClient('http://localhost', rate=0, retries=3,
+                                     backoff=1, max_backoff=60)
+    monkeypatch.setattr(client._session, 'get',
+                        lambda **kwargs: responses.pop(0))
+    assert client.get(44.4, 26.1).status_code == 200
+    # Backoff with jitter, then the Retry-After of the API
+    assert 0.5 <= sleeps[0] <= 1 and sleeps[1] == 2
+    client.close()
+
+
+def test_circuit_breaker():
+    breaker = geocoder.CircuitBreaker(threshold=2, cooldown=0.05)
+    breaker.record(False)
+    assert breaker.state == 'closed'
+    breaker.record(False)
+    assert breaker.state == 'open'
+    start = time.monotonic()
+    breaker.wait()
+    assert time.monotonic() - start >= 0.04
+    assert breaker.state == 'half-open'
+    # The probe failed: paused for twice the cooldown
+    breaker.record(False)
+    assert breaker.state == 'open'
+    breaker.wait()
+    breaker.record(True)
+    assert breaker.state == 'closed'
+
+
+def test_nearby_index(tmp_path):
+    import cache
+    disk_cache = cache.DiskCache(str(tmp_path / 'cache.db'))
+    disk_cache.set((44.4268, 26.1025), {
+        'name': 'Piata Unirii', 'address': {
+            'road': 'Bulevardul Unirii', 'city': 'Bucharest',
+            'state': 'Bucuresti', 'country': 'Romania'}})
+    disk_cache.set((0.0, 0.0), {'error': 'Unable to geocode'}, ttl=60)
+    index = geocoder.NearbyIndex(radius=25, admin_radius=2000).seed(
+        disk_cache.items())
+    assert len(index) == 1
+    # ~10m away
+    assert index.reverse(44.42689, 26.1025) == {
+        'name': 'Piata Unirii', 'address': {
+            'city': 'Bucharest', 'state': 'Bucuresti', 'country': 'Romania'}}
+    # ~1km away: same city, without the place
+    assert index.reverse(44.4358, 26.1025) == {
+        'name': None, 'address': {
+            'city': 'Bucharest', 'state': 'Bucuresti', 'country': 'Romania'}}
+    assert index.reverse(44.5, 26.1025) is None
+    assert index.reverse(0.0, 0.0) is None
+    disk_cache.close()
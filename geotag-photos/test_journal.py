@@ -0,0 +1,52 @@
+import cache
+import journal
+import manifest
+
+
+def test_journal_resume(tmp_path):
+    journal_file = str(tmp_path / 'journal.jsonl')
+    for name in ('2018_09_10', '2018_09_11', '2018_09_12'):
+        (tmp_path / '2018' / name).mkdir(parents=True)
+        (tmp_path / '2018' / name / 'IMG_0001.jpg').write_bytes(b'jpeg')
+    done, changed, new = [str(tmp_path / '2018' / name) for name in (
+        '2018_09_10', '2018_09_11', '2018_09_12')]
+    calls = []
+
+    def lookup(lat, lon):
+        calls.append((lat, lon))
+        return {'name': 'Place {} {}'.format(lat, lon)}
+
+    run = journal.Journal(journal_file).start(resume=False)
+    geocode = cache.Cache()(lookup)
+    run.attach(geocode.cache)
+    geocode(44.4, 26.1)
+    run.folder_done(done, manifest.checksum(manifest.scan(done)),
+                    {'Country': 'RO'})
+    run.folder_done(changed, manifest.checksum(manifest.scan(changed)),
+                    None)
+    geocode(45.7, 21.2)
+    # Crash while writing the next line
+    run._file.write('{"folder": "/photos/2018/20')
+    run.close()
+
+    resumed = journal.Journal(journal_file).start(resume=True)
+    assert sorted(resumed.completed) == [done, changed]
+    assert resumed.completed[done]['locations'] == {'Country': 'RO'}
+    geocode = cache.Cache()(lookup)
+    resumed.replay(geocode.cache)
+    resumed.attach(geocode.cache)
+    assert geocode(45.7, 21.2) == {'name': 'Place 45.7 21.2'}
+    assert len(calls) == 2
+    # Changed after the crash
+    (tmp_path / '2018' / '2018_09_11' / 'IMG_0002.jpg').write_bytes(b'jpeg')
+    assert list(resumed.pending([done, changed, new])) == [changed, new]
+    resumed.folder_done(new, 'md5', None)
+    resumed.folder_done(new, 'md5 2', None)
+    resumed.compact()
+    resumed.folder_done(changed, 'md5 3', None)
+    resumed.close()
+    with open(journal_file) as f:
+        assert len(f.readlines()) == 4
+    completed = journal.Journal(journal_file).load().completed
+    assert completed[new]['checksum'] == 'md5 2'
+    assert completed[changed]['checksum'] == 'md5 3'
@@ -0,0 +1,68 @@
+import threading
+import main
+import mongo
+import photos
+
+
+class Collection(object):
+    def __init__(self, *args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def find(self, query, projection):
+        return []
+
+    def bulk_write(self, requests, ordered):
+        pass
+
+
+class Queue(object):
+    """ Jobs queue shared with another worker, which holds the folder 'z'
+        until our folders are done
+    """
+    def __init__(self, folders):
+        self.pending = list(folders)
+        self.held = set()
+        self.finished = []
+        self.other_done = False
+        self.timed_out = False
+        self._condition = threading.Condition()
+
+    def claimed(self):
+        while True:
+            with self._condition:
+                if not self.pending:
+                    # Waits for the other worker, as JobQueue.claimed()
+                    if not self._condition.wait_for(
+                            lambda: self.other_done, timeout=5):
+                        self.timed_out = True
+                    return
+                folder = self.pending.pop(0)
+                self.held.add(folder)
+            yield folder
+
+    def done(self, folder):
+        with self._condition:
+            self.held.discard(folder)
+            self.finished.append(folder)
+            if not self.pending and not self.held:
+                self.other_done = True
+                self._condition.notify_all()
+
+    failed = done
+
+
+def test_worker_does_not_hold_claimed_folders(monkeypatch):
+    monkeypatch.setattr(mongo, 'MongoConnector', Collection)
+    monkeypatch.setattr(photos, 'scan_dir', lambda *args: {
+        'cached': True, 'checksum': 'abc', 'locations': None})
+    queue = Queue(['/photos/2018_09_10', '/photos/2018_09_11'])
+    assert main.run_pipeline(queue.claimed(), False, job_queue=queue) == 2
+    assert not queue.timed_out
+    assert sorted(queue.finished) == [
+        '/photos/2018_09_10', '/photos/2018_09_11']
@@ -0,0 +1,27 @@
+import manifest
+import os
+
+
+def test_manifest_added_files(tmp_path):
+    for name in ('IMG_0001.jpg', 'IMG_0002.jpg'):
+        (tmp_path / name).write_bytes(b'jpeg')
+    (tmp_path / '@eaDir').mkdir()
+    files_manifest = manifest.scan(str(tmp_path))
+    assert sorted(files_manifest) == ['IMG_0001.jpg', 'IMG_0002.jpg']
+    stored = manifest.to_list(files_manifest)
+    assert manifest.from_list(stored) == files_manifest
+
+    (tmp_path / 'IMG_0003.jpg').write_bytes(b'jpeg')
+    new_manifest = manifest.scan(str(tmp_path))
+    assert manifest.checksum(new_manifest) != manifest.checksum(
+        files_manifest)
+    assert manifest.added_files(stored, new_manifest) == ['IMG_0003.jpg']
+    assert manifest.added_files(None, new_manifest) is None
+
+    # Modified or removed files: the whole directory has to be read
+    (tmp_path / 'IMG_0001.jpg').write_bytes(b'modified jpeg')
+    assert manifest.added_files(
+        stored, manifest.scan(str(tmp_path))) is None
+    os.remove(str(tmp_path / 'IMG_0002.jpg'))
+    assert manifest.added_files(
+        stored, manifest.scan(str(tmp_path))) is None
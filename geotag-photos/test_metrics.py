@@ -0,0 +1,39 @@
+import json
+import metrics
+import time
+
+
+def test_metrics_export(tmp_path):
+    metrics.registry.reset()
+
+    @metrics.timed('metadata')
+    def get_metadata(directory):
+        time.sleep(0.01 if directory == 'slow' else 0)
+
+    for directory in ('fast', 'slow', 'fast'):
+        get_metadata(directory)
+    with metrics.timer('rename', 'slow'):
+        pass
+    metrics.inc('pictures_total', 30)
+    metrics.observe('http_request_seconds', 0.2, status='200')
+
+    prometheus_file = str(tmp_path / 'geotag.prom')
+    summary_file = str(tmp_path / 'summary.json')
+    summary = metrics.export({'metrics_prometheus_file': prometheus_file,
+                              'metrics_summary_file': summary_file,
+                              'metrics_slowest': 1})
+
+    assert summary['stages']['stage_seconds[stage=metadata]']['count'] == 3
+    assert summary['counters']['pictures_total'] == 30
+    assert [directory for directory, seconds in
+            summary['slowest_directories']] == ['slow']
+    with open(summary_file) as f:
+        assert json.load(f)['counters'] == summary['counters']
+    with open(prometheus_file) as f:
+        prometheus = f.read()
+    assert '# TYPE geotag_stage_seconds histogram' in prometheus
+    assert ('geotag_http_request_seconds_bucket{status="200",le="0.25"} 1'
+            in prometheus)
+    assert '# TYPE geotag_pictures_total counter' in prometheus
+    assert '# TYPE geotag_run_seconds gauge' in prometheus
+    assert 'geotag_pictures_total 30.0' in prometheus
@@ -0,0 +1,36 @@
+import mongo
+
+
+class Collection(object):
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def find(self, query, projection):
+        self.queries.append(query)
+        return [{key: document[key] for key in projection
+                 if projection[key] and key in document}
+                for document in self.documents
+                if document['directory'] in query['directory']['$in']]
+
+
+def test_load_directories(monkeypatch):
+    collection = Collection([
+        {'directory': '2018_09_10 Bucharest', 'directory_checksum': 'a',
+         'locations': {'Country': 'Romania'}, 'manifest': []},
+        {'directory': '2018_09_12', 'directory_checksum': 'b',
+         'locations': None}])
+    monkeypatch.setattr(mongo, 'MongoConnector', lambda *args: collection)
+    records = mongo.load_directories(
+        name for name in ['2018_09_10 Bucharest', '2018_09_11'])
+    # One query, without the manifest
+    assert len(collection.queries) == 1
+    assert records == {'2018_09_10 Bucharest': {
+        'directory': '2018_09_10 Bucharest', 'directory_checksum': 'a',
+        'locations': {'Country': 'Romania'}}}
@@ -0,0 +1,143 @@
+import pytest
+import folders
+import manifest
+import photos
+from config import config
+
+
+def test_scan_dir(tmp_path, monkeypatch):
+    folder = tmp_path / '2018_09_10'
+    folder.mkdir()
+    for name in ('IMG_0001.jpg', 'IMG_0002.jpg'):
+        (folder / name).write_bytes(b'jpeg')
+    files_manifest = manifest.scan(str(folder))
+    record = {
+        'directory': '2018_09_10',
+        'directory_checksum': manifest.checksum(files_manifest),
+        'manifest': manifest.to_list(files_manifest),
+        'locations': {'Country': 'Romania', 'Areas': {'Bucharest': {}}},
+        'openmaps_urls': ['url']}
+    loaded = []
+
+    def load_record_from_db(directory):
+        loaded.append(directory)
+        return record
+
+    monkeypatch.setattr(photos, 'load_record_from_db', load_record_from_db)
+    records = {'2018_09_10': record}
+
+    # Unchanged: nothing to read, the full record isn't even loaded
+    state = photos.scan_dir(str(folder), records=records)
+    assert state['cached'] and state['files'] == []
+    assert state['locations'] == record['locations']
+    assert loaded == []
+
+    # Added file: only it is read, on top of the stored locations
+    (folder / 'IMG_0003.jpg').write_bytes(b'jpeg')
+    state = photos.scan_dir(str(folder), records=records)
+    assert not state['cached']
+    assert state['files'] == ['IMG_0003.jpg']
+    assert state['locations'] == record['locations']
+    assert state['openmaps_urls'] == ['url']
+    assert loaded == [str(folder)]
+
+    # Modified file: the whole folder is read again
+    (folder / 'IMG_0001.jpg').write_bytes(b'modified jpeg')
+    state = photos.scan_dir(str(folder), records=records)
+    assert state['files'] == ['IMG_0001.jpg', 'IMG_0002.jpg',
+                              'IMG_0003.jpg']
+    assert state['locations'] is None
+
+    # skip_db: always read everything
+    assert photos.scan_dir(str(folder), skip_db=True)['files'] == [
+        'IMG_0001.jpg', 'IMG_0002.jpg', 'IMG_0003.jpg']
+
+
+def test_db_requests():
+    pictures = [{'SourceFile': '/photos/2018_09_10/IMG_0001.jpg',
+                 'Composite:GPSLatitude': 44.43,
+                 'Composite:GPSLongitude': 26.1,
+                 'Geotag:Area': 'Bucharest'}]
+    files_manifest = {'IMG_0001.jpg': [4, 10, 1],
+                      'IMG_0002.jpg': [4, 10, 2]}
+    requests = photos.db_requests(
+        '2018_09_10', '2018_09_10 Bucharest', 'abc', pictures, ['url'],
+        {'Country': 'Romania'}, files_manifest)
+    assert [collection for collection, request in requests] == [
+        'metadata', 'pictures', 'pictures']
+    record = requests[0][1]._doc['$set']
+    assert record['directory_checksum'] == 'abc'
+    assert record['files_count'] == 2
+    assert record['manifest'][0] == ['IMG_0001.jpg', 4, 10, 1]
+    assert requests[0][1]._doc['$unset'] == {'exiftools_metadata': ''}
+    picture = requests[1][1]._doc
+    assert picture['file'] == 'IMG_0001.jpg'
+    assert picture['area'] == 'Bucharest'
+    assert 'tags' not in picture
+    # The pictures removed from the directory
+    assert requests[2][1]._filter == {
+        'directory': '2018_09_10 Bucharest',
+        'file': {'$nin': ['IMG_0001.jpg', 'IMG_0002.jpg']}}
+
+
+def pictures(*points):
+    return [{'Composite:GPSLatitude': latitude,
+             'Composite:GPSLongitude': longitude}
+            for latitude, longitude in points]
+
+
+def test_locate_nearby(monkeypatch, openmaps):
+    monkeypatch.setitem(config, 'nearby_radius', 25)
+    monkeypatch.setitem(config, 'nearby_admin_radius', 5000)
+    locations, urls = photos.locate('a', pictures(*[(44.4268, 26.1025)] * 3))
+    assert locations['Areas'] == {'Bucharest': {'Piata Unirii': 3}}
+    assert len(openmaps.requests) == 1
+
+    # A few metres away: the answer of the resolved point. 2 km away: only
+    # its city, the pictures still count in the Area
+    metadata = pictures(*[(44.42681, 26.10251)] * 3 + [(44.44, 26.12)])
+    locations, urls = photos.locate('b', metadata)
+    assert len(openmaps.requests) == 1
+    assert urls == []
+    assert locations == {'Country': 'Romania',
+                         'Areas': {'Bucharest': {'Piata Unirii': 3}}}
+    assert (metadata[-1]['Geotag:Area'], metadata[-1]['Geotag:Place']) == (
+        'Bucharest', None)
+    locations, urls = photos.locate('c', pictures((44.44, 26.12)))
+    assert locations == {'Country': 'Romania', 'Areas': {'Bucharest': {}}}
+
+
+@pytest.mark.parametrize('coarse_zoom, requests', [(None, 8), (10, 5)])
+def test_locate_coarse_zoom(monkeypatch, openmaps, coarse_zoom, requests):
+    monkeypatch.setitem(config, 'coarse_zoom', coarse_zoom)
+
+    def answer(latitude, longitude, zoom=None):
+        name = None
+        if zoom:
+            pass
+        elif abs(longitude - 26.1025) < 0.001:
+            name = 'Piata Unirii'
+        elif abs(longitude - 26.0876) < 0.001:
+            name = 'Palatul Parlamentului'
+        else:
+            name = 'Street {}'.format(latitude)
+        return {'name': name, 'address': {
+            'city': 'Brasov' if latitude > 45 else 'Bucharest',
+            'country': 'Romania'}}
+
+    monkeypatch.setattr(openmaps, 'answer', answer)
+    # A place with 3 pictures, a place with 3 pictures in 3 clusters and 4
+    # pictures in different streets, 2 of them within 1 km
+    metadata = pictures(
+        *[(44.4268, 26.1025)] * 3 + [
+            (44.4271, 26.0875), (44.4273, 26.0877), (44.4275, 26.0875),
+            (44.45, 26.13), (44.452, 26.132), (44.40, 26.05),
+            (45.65, 25.6)])
+    locations, urls = photos.locate('a', metadata)
+    # The same folder name, with fewer requests
+    assert folders._generate_name(locations, '2018_09_10') == (
+        '2018_09_10 Romania - Bucharest (Piata Unirii, Palatul '
+        'Parlamentului), Brasov')
+    assert len(openmaps.requests) == requests
+    assert metadata[5]['Geotag:Place'] == 'Palatul Parlamentului'
+    assert metadata[-1]['Geotag:Area'] == 'Brasov'
@@ -0,0 +1,47 @@
+import time
+import pytest
+from pipeline import Pipeline, Stage
+
+
+def test_pipeline_stages():
+    results = []
+
+    def slow(item):
+        time.sleep(0.05)
+        return item
+
+    pipeline = Pipeline([
+        Stage('slow', slow, workers=4),
+        # Odd items are dropped
+        Stage('even', lambda item: None if item % 2 else item * 10, 2),
+        Stage('writer', results.append)
+        ], queue_size=2)
+    start = time.monotonic()
+    assert pipeline.run(range(20)) == 20
+    assert sorted(results) == list(range(0, 200, 20))
+    # 20 items * 0.05s on 4 workers
+    assert time.monotonic() - start < 0.5
+
+
+def test_pipeline_stage_error():
+    results = []
+    failed = []
+    pipeline = Pipeline([
+        Stage('invert', lambda item: 1 / item, on_error=failed.append),
+        Stage('writer', results.append)])
+    assert pipeline.run([0, 1, 2]) == 3
+    assert results == [1, 0.5]
+    assert failed == [0]
+
+
+def test_pipeline_source_error():
+    results = []
+
+    def source():
+        yield 1
+        raise OSError('photos_path unmounted')
+
+    pipeline = Pipeline([Stage('writer', results.append)])
+    with pytest.raises(OSError):
+        pipeline.run(source())
+    assert results == [1]
@@ -0,0 +1,31 @@
+import points
+
+
+def test_point_store():
+    table = points.LocationTable()
+    store = points.PointStore(merge_size=4, table=table)
+    home = {'name': 'Piata Unirii', 'address': {
+        'road': 'Bulevardul Unirii', 'city': 'Bucharest',
+        'country': 'Romania'}}
+    for i in range(10):
+        store.set((44.4268 + i * 1e-5, 26.1025), dict(home))
+    store.set((0.0, 0.0), {'error': 'Unable to geocode'})
+    store.set((44.4268, 26.1025, 10), home)
+    assert len(store) == 10
+    # Merged in the arrays: 12 bytes per point
+    assert store.nbytes() == 8 * 12
+    # The same record is shared by all the points of the place
+    assert len(table) == 1
+    assert store.get((44.42689, 26.1025)) == {
+        'name': 'Piata Unirii',
+        'address': {'city': 'Bucharest', 'country': 'Romania'}}
+    assert store.get((44.4268 + 2e-5, 26.1025)) is not None
+    assert store.get((44.5, 26.1025)) is None
+    assert store.get((0.0, 0.0)) is None
+    assert store.get((44.4268, 26.1025, 10)) is None
+
+
+def test_location_key():
+    payload = {'name': 'Piata Unirii', 'address': {'city': 'Bucharest'}}
+    location = points.Location.from_payload(payload)
+    assert location.key() == points.Location.payload_key(payload)
@@ -0,0 +1,35 @@
+import photos
+import prefetch
+
+
+def test_prefetch(monkeypatch, openmaps):
+    # One place photographed in two folders (a single cell), a point
+    # without result in two folders and a point whose request fails
+    folders = {
+        'a': [(44.4268, 26.1025)] * 3,
+        'b': [(44.42681, 26.10251)] * 3,
+        'c': [(45.0, 25.0)],
+        'd': [(45.00001, 25.00001), (46.0, 24.0)]}
+    metadata = {folder: [{'Composite:GPSLatitude': latitude,
+                          'Composite:GPSLongitude': longitude}
+                         for latitude, longitude in points]
+                for folder, points in folders.items()}
+    openmaps.answers[(45.0, 25.0)] = {'error': 'Unable to geocode'}
+    openmaps.answers[(46.0, 24.0)] = None
+    monkeypatch.setattr(photos, 'scan_dir', lambda *args: {
+        'cached': False, 'files': ['IMG_0001.jpg']})
+    monkeypatch.setattr(photos, 'get_metadata',
+                        lambda folder, files: metadata[folder])
+
+    assert prefetch.run(sorted(folders)) == (5, 3)
+    assert len(openmaps.requests) == 3
+
+    # The folders are located from the cache, only the failed request is
+    # made again
+    locations, urls = photos.locate('a', metadata['a'])
+    assert locations['Areas'] == {'Bucharest': {'Piata Unirii': 3}}
+    locations, urls = photos.locate('b', metadata['b'])
+    assert locations['Areas'] == {'Bucharest': {'Piata Unirii': 3}}
+    assert photos.locate('c', metadata['c'])[0] is None
+    photos.locate('d', metadata['d'])
+    assert openmaps.requests[3:] == [(46.0, 24.0, None)]
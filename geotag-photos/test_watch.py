@@ -0,0 +1,73 @@
+import discovery
+import os
+import pytest
+import time
+import watch
+
+
+def test_debouncer():
+    debouncer = watch.Debouncer(delay=30)
+    assert debouncer.timeout(now=0) is None
+    debouncer.touch('/photos/2018/2018_09_10', now=0)
+    debouncer.touch('/photos/2018/2018_09_11', now=10)
+    # Still being copied
+    debouncer.touch('/photos/2018/2018_09_10', now=20)
+    assert debouncer.timeout(now=25) == 15
+    assert debouncer.ready(now=45) == ['/photos/2018/2018_09_11']
+    assert debouncer.ready(now=50) == ['/photos/2018/2018_09_10']
+    assert len(debouncer) == 0
+
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / '2018' / '2018_09_10').mkdir(parents=True)
+    watcher = watch.PollingWatcher(
+        str(tmp_path), discovery.Selection(), interval=0)
+    assert watcher.read(0) == set()
+    (tmp_path / '2018' / '2018_09_10' / 'IMG_0001.jpg').write_bytes(b'jpeg')
+    os.utime(str(tmp_path / '2018' / '2018_09_10'), ns=(1, 1))
+    (tmp_path / '2018' / '2018_09_11').mkdir()
+    assert watcher.read(0) == {str(tmp_path / '2018' / '2018_09_10'),
+                               str(tmp_path / '2018' / '2018_09_11')}
+
+
+def test_polling_debounce(tmp_path):
+    folder = tmp_path / '2018' / '2018_09_10'
+    folder.mkdir(parents=True)
+    processed = []
+    watcher = watch.PollingWatcher(
+        str(tmp_path), discovery.Selection(), interval=0.2)
+    # A folder changed between two scans is not ready: the debounce is at
+    # least one polling interval
+    daemon = watch.Daemon(watcher, processed.extend, debounce=0)
+    (folder / 'IMG_0001.jpg').write_bytes(b'jpeg')
+    os.utime(str(folder), ns=(1, 1))
+    while not len(daemon._debouncer):
+        daemon.run_once(0.05)
+    seen = time.monotonic()
+    while not processed:
+        daemon.run_once(0.05)
+    assert time.monotonic() - seen >= 0.2
+    assert processed == [str(folder)]
+
+
+def test_inotify_watcher(tmp_path):
+    (tmp_path / '2018' / '2018_09_10').mkdir(parents=True)
+    try:
+        watcher = watch.InotifyWatcher(str(tmp_path), discovery.Selection())
+    except OSError:
+        pytest.skip('inotify not available')
+    (tmp_path / '2018' / '2018_09_10' / 'IMG_0001.jpg').write_bytes(b'jpeg')
+    (tmp_path / '2018' / '2018_09_10' / '@eaDir').mkdir()
+    assert watcher.read(1) == {str(tmp_path / '2018' / '2018_09_10')}
+    # New year and folders are watched as they are created
+    (tmp_path / '2019' / '2019_01_01').mkdir(parents=True)
+    changed = set()
+    while True:
+        events = watcher.read(0.2)
+        if not events:
+            break
+        changed |= events
+    assert changed == {str(tmp_path / '2019' / '2019_01_01')}
+    (tmp_path / '2019' / '2019_01_01' / 'IMG_0001.jpg').write_bytes(b'jpeg')
+    assert watcher.read(1) == {str(tmp_path / '2019' / '2019_01_01')}
+    watcher.close()
@@ -0,0 +1,87 @@
+import threading
+import bson.errors
+import mongo
+import writebehind
+from pymongo import errors
+
+
+def test_write_behind():
+    batches = []
+    done = []
+    blocked = threading.Event()
+
+    def write(requests):
+        blocked.wait()
+        batches.append(requests)
+
+    writer = writebehind.WriteBehind(batch_size=10, queue_size=10,
+                                     write=write)
+    # The first folder is written alone, the next ones while it's written
+    # are batched, except the folder queued twice
+    for folder in ['a', 'b', 'c', 'b']:
+        writer.submit(folder, [('metadata', folder)],
+                      lambda written, folder=folder: done.append(folder))
+    blocked.set()
+    writer.close()
+    assert done == ['a', 'b', 'c', 'b']
+    assert [request for batch in batches for request in batch] == [
+        ('metadata', folder) for folder in ['a', 'b', 'c', 'b']]
+    assert batches[-1] == [('metadata', 'b')]
+    assert len(batches) in (2, 3)
+
+
+def test_write_behind_without_requests():
+    done = []
+    writer = writebehind.WriteBehind(write=lambda requests: 1 / 0)
+    writer.submit('a', None, lambda written: done.append(written))
+    writer.close()
+    assert done == [True]
+
+
+def test_write_behind_errors():
+    results = []
+    down = threading.Event()
+
+    def write(requests):
+        if down.is_set():
+            raise errors.AutoReconnect('DB down')
+        if ('pictures', 'bad') in requests:
+            raise bson.errors.InvalidDocument('bad EXIF value')
+
+    writer = writebehind.WriteBehind(batch_size=10, write=write)
+    # Written one by one after the batch failed: only 'b' fails
+    for folder in ['a', 'b', 'c']:
+        writer.submit(folder, [('pictures', 'bad' if folder == 'b' else
+                                folder)],
+                      lambda written, folder=folder: results.append(
+                          (folder, written)))
+    writer.close()
+    assert results == [('a', True), ('b', False), ('c', True)]
+
+    writer = writebehind.WriteBehind(write=write)
+    down.set()
+    writer.submit('d', [('metadata', 'd')],
+                  lambda written: results.append(('d', written)))
+    writer.close()
+    assert results[-1] == ('d', False)
+
+
+def test_write_metadata_last(monkeypatch):
+    written = []
+
+    class Connector(object):
+        def __init__(self, collection):
+            self._collection = collection
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def bulk_write(self, requests, ordered):
+            written.append(self._collection)
+
+    monkeypatch.setattr(mongo, 'MongoConnector', Connector)
+    mongo.write([('metadata', 1), ('pictures', 2), ('pictures', 3)])
+    assert written == ['pictures', 'metadata']
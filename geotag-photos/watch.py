@@ -0,0 +1,351 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+import discovery
+import logger
+import metrics
+
+log = logger.generate_logger()
+
+"""
+Daemon mode: instead of checking the whole photos_path from cron, the tree
+is watched and only the new or changed folders are geotagged. Since the
+process keeps running, the exiftool workers, the HTTP session, the Mongo
+client and the caches stay warm between the events.
+    - InotifyWatcher: inotify (Linux) watches on photos_path, the year
+      directories and the folders
+    - PollingWatcher: compares the modification times of the folders every
+      watch_poll_interval seconds. inotify doesn't see the changes made by
+      other hosts on network mounts (NFS, SMB), use watch: poll there
+    - Debouncer: a folder is processed once nothing changed in it for
+      watch_debounce seconds, not while it's still being copied
+Usage:
+    daemon = watch.get_daemon(config, process)
+    daemon.run()
+"""
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+EVENT = struct.Struct('iIII')
+
+# Watch mask of photos_path (depth 0), the years (1) and the folders (2)
+MASKS = (IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM,
+         IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM,
+         IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE)
+
+
+def _libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+class InotifyWatcher(object):
+    """Description:
+            Watches the folders of the selection with inotify. New years
+            and folders are watched as they are created.
+            Raises OSError if inotify isn't available or if the
+            fs.inotify.max_user_watches limit is reached.
+
+       Usage:
+            watcher = InotifyWatcher('/Volumes/photo/', selection)
+            changed_folders = watcher.read(timeout=1)
+    """
+    def __init__(self, root, selection):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        try:
+            self._libc = _libc()
+            self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, 'inotify not available: {}'.format(e))
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self._root = root
+        self._selection = selection
+        # Watch descriptor -> (path, depth)
+        self._watches = {}
+        try:
+            self._add(root, 0)
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, path, depth):
+        """ Watches the directory and its selected subdirectories
+
+            Returns:
+                list of the folders found
+        """
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), MASKS[depth])
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return []
+            raise OSError(error, 'inotify_add_watch {}'.format(path))
+        self._watches[wd] = (path, depth)
+        if depth == 2:
+            return [path]
+        accepted = self._selection.year if depth == 0 else \
+            self._selection.folder
+        folders = []
+        try:
+            entries = discovery.subdirectories(path)
+        except OSError:
+            return []
+        for name, subdirectory in entries:
+            if accepted(name):
+                folders += self._add(subdirectory, depth + 1)
+        return folders
+
+    def _remove(self, path):
+        for wd, (watched, depth) in list(self._watches.items()):
+            if watched == path or watched.startswith(path + os.sep):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def rescan(self):
+        """ Watches the missing directories, after a queue overflow
+
+            Returns:
+                set of all the watched folders, since events were lost
+        """
+        watched = set(path for path, depth in self._watches.values())
+        for year_name, year_path in discovery.subdirectories(self._root):
+            if self._selection.year(year_name) and year_path not in watched:
+                self._add(year_path, 1)
+        for folder in self._selection.walk(self._root):
+            if folder not in watched:
+                self._add(folder, 2)
+        return set(path for path, depth in self._watches.values()
+                   if depth == 2)
+
+    def read(self, timeout=None):
+        """ Waits up to timeout seconds for events
+
+            Returns:
+                set of the folders having new, moved or deleted files
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = os.fsdecode(
+                data[offset + EVENT.size:offset + EVENT.size + length]
+                .rstrip(b'\0'))
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                log.warning("inotify queue overflow, rescanning")
+                changed |= self.rescan()
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if wd not in self._watches or not name:
+                continue
+            path, depth = self._watches[wd]
+            # @eaDir thumbnails, .DS_Store... created by the NAS or clients
+            if discovery.is_hidden(name):
+                continue
+            if depth == 2:
+                changed.add(path)
+            elif mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                self._remove(os.path.join(path, name))
+            elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                accepted = self._selection.year if depth == 0 else \
+                    self._selection.folder
+                if accepted(name):
+                    changed.update(self._add(
+                        os.path.join(path, name), depth + 1))
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher(object):
+    """Description:
+            Finds the new or changed folders of the selection by comparing
+            their modification time every 'interval' seconds. Adding,
+            removing or renaming a file changes the mtime of its folder.
+
+       Usage:
+            watcher = PollingWatcher('/Volumes/photo/', selection, 60)
+            changed_folders = watcher.read(timeout=1)
+    """
+    def __init__(self, root, selection, interval=60):
+        self._root = root
+        self._selection = selection
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for folder in self._selection.walk(self._root):
+            try:
+                snapshot[folder] = os.stat(folder).st_mtime_ns
+            except OSError:
+                pass
+        return snapshot
+
+    def read(self, timeout=None):
+        """ Waits up to timeout seconds for the next scan
+
+            Returns:
+                set of the new or changed folders
+        """
+        wait = self._next_scan - time.monotonic()
+        if wait > 0:
+            time.sleep(wait if timeout is None else min(wait, timeout))
+            return set()
+        snapshot = self._scan()
+        changed = set(folder for folder, mtime in snapshot.items()
+                      if self._snapshot.get(folder) != mtime)
+        self._snapshot = snapshot
+        self._next_scan = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        pass
+
+
+class Debouncer(object):
+    """Description:
+            Folders are ready once they didn't change for 'delay' seconds.
+
+       Usage:
+            debouncer = Debouncer(30)
+            debouncer.touch(folder)
+            debouncer.ready()
+    """
+    def __init__(self, delay=30):
+        self._delay = delay
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, folder, now=None):
+        self._pending[folder] = time.monotonic() if now is None else now
+
+    def timeout(self, now=None):
+        """ Returns the seconds until the next folder is ready or None
+        """
+        if not self._pending:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0, min(self._pending.values()) + self._delay - now)
+
+    def ready(self, now=None):
+        """ Returns (and forgets) the sorted folders ready to be processed
+        """
+        now = time.monotonic() if now is None else now
+        folders = sorted(folder for folder, touched in self._pending.items()
+                         if now - touched >= self._delay)
+        for folder in folders:
+            del self._pending[folder]
+        return folders
+
+
+class Daemon(object):
+    """Description:
+            Feeds the folders reported by the watcher, once debounced, to
+            process(folders). Stops on SIGTERM, SIGINT or stop().
+            A polling watcher sees the changes only once per interval: the
+            debounce is at least one interval, so that a folder is ready
+            only if it didn't change between two scans.
+
+       Usage:
+            daemon = Daemon(watcher, process, debounce=30)
+            daemon.run()
+    """
+    def __init__(self, watcher, process, debounce=30):
+        self._watcher = watcher
+        self._process = process
+        interval = getattr(watcher, 'interval', 0)
+        if debounce < interval:
+            log.info("Debounce of {}s raised to the polling interval "
+                     "({}s)".format(debounce, interval))
+            debounce = interval
+        self._debouncer = Debouncer(debounce)
+        self._stopped = threading.Event()
+
+    def stop(self, *args):
+        self._stopped.set()
+
+    def run_once(self, timeout=1.0):
+        """ Reads the events and processes the ready folders
+
+            Returns:
+                list of the processed folders
+        """
+        next_ready = self._debouncer.timeout()
+        if next_ready is not None:
+            timeout = min(timeout, next_ready)
+        for folder in self._watcher.read(timeout):
+            self._debouncer.touch(folder)
+        # Moved or deleted meanwhile
+        folders = [folder for folder in self._debouncer.ready()
+                   if os.path.isdir(folder)]
+        if folders:
+            log.info("Processing {} changed folders".format(len(folders)))
+            metrics.inc('watch_folders_total', len(folders))
+            self._process(folders)
+        return folders
+
+    def run(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        log.info("Watching for new folders")
+        try:
+            while not self._stopped.is_set():
+                self.run_once()
+        finally:
+            self._watcher.close()
+
+
+def get_watcher(config, selection=None):
+    """ Returns the watcher of photos_path configured by 'watch':
+        'inotify', 'poll' or 'auto' (inotify with a fallback to polling)
+    """
+    selection = selection or discovery.get_selection(config)
+    mode = config.get('watch', 'auto')
+    if mode != 'poll':
+        try:
+            return InotifyWatcher(config['photos_path'], selection)
+        except OSError as e:
+            if mode == 'inotify':
+                raise
+            log.warning("inotify not usable ({}), polling".format(e))
+    return PollingWatcher(config['photos_path'], selection,
+                          config.get('watch_poll_interval', 60))
+
+
+def get_daemon(config, process):
+    return Daemon(get_watcher(config), process,
+                  config.get('watch_debounce', 30))
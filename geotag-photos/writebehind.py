@@ -0,0 +1,126 @@
+import queue
+import threading
+from pymongo import errors
+import logger
+import metrics
+import mongo
+
+log = logger.generate_logger()
+
+"""
+Write-behind persistence of the geotagged folders: the DB writes and the
+renames leave the pipeline. The writer stage only queues the results of a
+folder (its DB write requests and what to do once they are written: rename,
+journal...) and goes on with the next folder. A background thread:
+    - takes all the queued folders, up to batch_size
+    - writes their requests with one bulk_write per collection
+    - then runs their callbacks (rename...) in the order they were queued,
+      with False if the requests couldn't be written
+The queue is bounded (queue_size folders): when the DB can't keep up, the
+pipeline waits instead of keeping the results in memory. close() flushes
+the queue before returning.
+Usage:
+    writer = WriteBehind(batch_size=100, queue_size=1000)
+    writer.submit(folder, requests, callback)
+    writer.close()
+"""
+
+_DONE = object()
+
+
+class WriteBehind(object):
+    """Description:
+            Bounded queue of the DB writes of the folders, written in
+            batches by a background thread. The callback of a folder runs
+            after its requests are written, in order: callback(written),
+            written is False if the write failed.
+
+       Usage:
+            writer = WriteBehind(batch_size=100, queue_size=1000)
+            writer.submit(folder, requests, callback)
+            writer.close()
+    """
+    def __init__(self, batch_size=100, queue_size=1000, write=mongo.write):
+        self._batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._write = write
+        self._thread = threading.Thread(
+            target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def submit(self, folder, requests=None, callback=None):
+        """ Queues the write requests of the folder (list of (collection,
+            pymongo write operation)) and the function to call once they
+            are written, callback(written). Waits if the queue is full
+        """
+        self._queue.put((folder, requests or [], callback))
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not _DONE and len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _DONE
+            if stop:
+                batch.pop()
+            try:
+                self._flush(batch)
+            except Exception:
+                log.exception("Write-behind of {} folders failed".format(
+                    len(batch)))
+            if stop:
+                return
+
+    def _flush(self, batch):
+        # The requests of a folder queued twice (watch mode) are written
+        # in two bulk writes, not to be reordered in an unordered one
+        start = 0
+        while start < len(batch):
+            end, folders = start, set()
+            while end < len(batch) and batch[end][0] not in folders:
+                folders.add(batch[end][0])
+                end += 1
+            self._write_batch(batch[start:end])
+            start = end
+
+    def _write_batch(self, batch):
+        requests = [request for folder, folder_requests, callback in batch
+                    for request in folder_requests]
+        written = True
+        if requests:
+            # Any error (ex. bson InvalidDocument, not a PyMongoError)
+            # fails the batch, not the thread
+            try:
+                with metrics.timer('db'):
+                    self._write(requests)
+            except Exception as e:
+                # A bad document (not the DB) fails only its folder
+                if len(batch) > 1 and not isinstance(
+                        e, errors.ConnectionFailure):
+                    for item in batch:
+                        self._write_batch([item])
+                    return
+                log.error("Cannot write {} folders in the DB: {}".format(
+                    len(batch), e))
+                metrics.inc('write_behind_failed_total', len(batch))
+                written = False
+            metrics.inc('write_behind_batches_total')
+        for folder, folder_requests, callback in batch:
+            if callback is None:
+                continue
+            try:
+                callback(written)
+            except Exception:
+                log.exception("Write-behind of {} failed".format(folder))
+
+    def close(self):
+        """ Writes the queued folders and stops the thread
+        """
+        self._queue.put(_DONE)
+        self._thread.join()